@@ -0,0 +1,297 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Headless benchmarks for the Stop Motion add-on
+
+Run from the repository root, naming one or more benchmarks (or none for
+all of them):
+    blender -b --factory-startup --python resources/benchmark.py -- scrub
+"""
+
+import addon_utils
+import bmesh
+import bpy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+addon_utils.enable("stop_motion", default_set=True)
+
+from stop_motion import animation
+from stop_motion import drawing_cache
+from stop_motion import json_nodes
+from stop_motion import modifier_data
+from stop_motion import node_library
+from stop_motion import obj_io
+from stop_motion.modifier_data import Modifier
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under its function name"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timed(func, repeat=1):
+    """Average seconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name, **values):
+    print(name, " ".join(f"{key}={value}" for key, value in values.items()))
+
+# Scene Helpers
+
+
+def reset():
+    bpy.ops.wm.read_homefile(use_empty=True)
+    return bpy.context.scene
+
+
+def new_stop_motion_object(scene, lookup='COLLECTION', subdivisions=3):
+    """An initialized stop motion ico sphere, active in scene"""
+    mesh = bpy.data.meshes.new("bench")
+    bm = bmesh.new()
+    bmesh.ops.create_icosphere(bm, subdivisions=subdivisions, radius=1)
+    bm.to_mesh(mesh)
+    bm.free()
+    obj = bpy.data.objects.new("bench", mesh)
+    scene.collection.objects.link(obj)
+    bpy.context.view_layer.objects.active = obj
+    scene.frame_set(1)
+    bpy.ops.object.add_stop_motion(lookup=lookup)
+    return obj
+
+
+def populate(obj, count):
+    """Fill obj up to count drawings, one per frame, without the operators"""
+    modifier = Modifier(obj)
+    collection = modifier.collection
+    source = modifier.get_object(0)
+    for index in range(len(collection.objects), count):
+        drawing = bpy.data.objects.new(
+            modifier.object_name(index), source.data.copy())
+        modifier_data.tag_drawing(drawing, index)
+        collection.objects.link(drawing)
+    fcurve = modifier.get_fcurve()
+    points = fcurve.keyframe_points
+    points.add(count - len(points))
+    points.foreach_set(
+        "co", [value for index in range(count) for value in (index + 1, index)])
+    points.foreach_set("interpolation", [0] * count) # CONSTANT
+    fcurve.update()
+
+# Benchmarks
+
+
+@benchmark
+def scrub(sizes=(10, 100, 1000, 10000), samples=100):
+    """Random access frame changes against the number of drawings"""
+    for lookup in ('COLLECTION', 'OBJECT'):
+        for size in sizes:
+            scene = reset()
+            obj = new_stop_motion_object(scene, lookup=lookup)
+            populate(obj, size)
+            rng = random.Random(size)
+            frames = iter([rng.randint(1, size) for _ in range(samples)])
+            seconds = timed(lambda: scene.frame_set(next(frames)), samples)
+            report(
+                "scrub", lookup=lookup, drawings=size,
+                ms_per_frame=f"{seconds * 1000:.3f}")
+
+
+@benchmark
+def modifier(repeat=10000, per_redraw=8):
+    """Modifier construction with and without memoized socket identifiers"""
+    obj = new_stop_motion_object(reset())
+
+    def cold():
+        modifier_data.invalidate_identifiers()
+        return Modifier(obj).index
+
+    cold_seconds = timed(cold, repeat)
+    warm_seconds = timed(lambda: Modifier(obj).index, repeat)
+    poll_seconds = timed(lambda: modifier_data.is_stop_motion(obj), repeat)
+    # The sidebar draw plus its operator button polls construct about 8
+    report(
+        "modifier",
+        cold_us=f"{cold_seconds * 1e6:.2f}",
+        warm_us=f"{warm_seconds * 1e6:.2f}",
+        poll_us=f"{poll_seconds * 1e6:.2f}",
+        saved_us_per_redraw=f"{(cold_seconds - warm_seconds) * per_redraw * 1e6:.2f}")
+
+
+@benchmark
+def insert(count=300):
+    """Scripted import of count drawings, one by one against batched"""
+    def setup():
+        scene = reset()
+        obj = new_stop_motion_object(scene)
+        meshes = [obj.data.copy() for _ in range(count)]
+        return scene, meshes
+
+    scene, meshes = setup()
+
+    def one_by_one():
+        for frame, mesh in enumerate(meshes, start=2):
+            scene.frame_set(frame)
+            animation.insert_keyframe(bpy.context, mesh, use_copy=False)
+
+    single = timed(one_by_one)
+    scene, meshes = setup()
+    batched = timed(lambda: animation.insert_keyframes(
+        bpy.context, [(m, f) for f, m in enumerate(meshes, start=2)],
+        use_copy=False))
+    report(
+        "insert", drawings=count, single_s=f"{single:.3f}",
+        batched_s=f"{batched:.3f}")
+
+
+@benchmark
+def onion(puppets=4, drawings=24, skins=5, samples=100):
+    """Viewport evaluation with onion skins, object per skin against single"""
+    for engine in ('OBJECTS', 'SINGLE'):
+        scene = reset()
+        for _ in range(puppets):
+            obj = new_stop_motion_object(scene)
+            populate(obj, drawings)
+            settings = obj.onion_skin_settings
+            settings.engine = engine
+            settings.before = settings.after = skins
+            settings.enable = True
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        frames = iter(range(samples))
+
+        def evaluate():
+            scene.frame_set(next(frames) % drawings + 1)
+            depsgraph.update()
+
+        seconds = timed(evaluate, samples)
+        report(
+            "onion", engine=engine, puppets=puppets, skins=2 * skins,
+            objects=len(depsgraph.object_instances),
+            ms_per_frame=f"{seconds * 1000:.3f}")
+
+
+@benchmark
+def serialize(repeat=20):
+    """Node group serialization with and without cached property schemas,
+    checking the output still matches the shipped templates"""
+    reset()
+    templates = json_nodes.bundle(node_library.BUNDLE)
+    for name in templates:
+        node_library.read_group(name)
+
+        def cold():
+            json_nodes.schemas.clear()
+            json_nodes.sanitizers.clear()
+            return json_nodes.Node_Tree(name)
+
+        cold_seconds = timed(cold, repeat)
+        warm_seconds = timed(lambda: json_nodes.Node_Tree(name), repeat)
+        identical = (
+            json_nodes.encode(cold().tree_data)
+            == json_nodes.encode(templates.tree_data(name)))
+        report(
+            "serialize", group=name, cold_ms=f"{cold_seconds * 1000:.3f}",
+            warm_ms=f"{warm_seconds * 1000:.3f}", identical=identical)
+
+
+@benchmark
+def sequence(count=1000, subdivisions=4):
+    """Folder import, parsing then building against the threaded pipeline"""
+    with tempfile.TemporaryDirectory() as directory:
+        obj = new_stop_motion_object(reset(), subdivisions=subdivisions)
+        buffers = obj_io.drawing_buffers(Modifier(obj).get_object())
+        rng = random.Random(count)
+        for number in range(count):
+            jitter = buffers.positions * (1 + 0.05 * rng.random())
+            obj_io.mesh_io.write_obj(
+                os.path.join(directory, f"frame_{number}.obj"),
+                buffers._replace(positions=jitter))
+        files = obj_io.sequence_files(directory)
+
+        start = time.perf_counter()
+        parsed = [obj_io.mesh_io.read_mesh(f) for f in files]
+        parse_seconds = time.perf_counter() - start
+        template = Modifier(obj).get_object().data
+        animation.insert_keyframes(bpy.context, [
+            (obj_io.mesh_from_buffers(os.path.basename(f), b, template), frame)
+            for frame, (f, b) in enumerate(zip(files, parsed), start=2)],
+            use_copy=False)
+        serial_seconds = time.perf_counter() - start
+
+        obj = new_stop_motion_object(reset(), subdivisions=subdivisions)
+        pipelined_seconds = timed(lambda: obj_io.SequenceImport(
+            bpy.context, files, 2).run(bpy.context))
+        report(
+            "sequence", files=count, parse_s=f"{parse_seconds:.3f}",
+            serial_s=f"{serial_seconds:.3f}",
+            pipelined_s=f"{pipelined_seconds:.3f}")
+
+
+@benchmark
+def cache(count=300, subdivisions=5):
+    """Drawing cache against an OBJ sequence, whole takes and one drawing"""
+    with tempfile.TemporaryDirectory() as directory:
+        obj = new_stop_motion_object(reset(), subdivisions=subdivisions)
+        populate(obj, count)
+        path = os.path.join(directory, "take.drawings")
+        obj_seconds = timed(lambda: obj_io.export_sequence(obj, directory))
+        cache_seconds = timed(lambda: drawing_cache.export_cache(obj, path))
+        files = obj_io.sequence_files(directory)
+        report(
+            "cache", drawings=count, obj_export_s=f"{obj_seconds:.3f}",
+            cache_export_s=f"{cache_seconds:.3f}",
+            obj_mb=f"{sum(map(os.path.getsize, files)) / 1e6:.1f}",
+            cache_mb=f"{os.path.getsize(path) / 1e6:.1f}")
+
+        new_stop_motion_object(reset(), subdivisions=subdivisions)
+        obj_seconds = timed(lambda: obj_io.SequenceImport(
+            bpy.context, files, 2).run(bpy.context))
+        new_stop_motion_object(reset(), subdivisions=subdivisions)
+        cache_seconds = timed(
+            lambda: drawing_cache.import_cache(bpy.context, path))
+        single_seconds = timed(lambda: bpy.data.meshes.remove(
+            drawing_cache.mesh_from_cache(
+                obj_io.mesh_io.DrawingCache(path), count // 2)), 20)
+        report(
+            "cache", drawings=count, obj_import_s=f"{obj_seconds:.3f}",
+            cache_import_s=f"{cache_seconds:.3f}",
+            one_drawing_ms=f"{single_seconds * 1000:.3f}")
+
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    for name in argv or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
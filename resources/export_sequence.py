@@ -0,0 +1,50 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Headless OBJ sequence export of a stop motion object
+
+Every keyed drawing, or the drawing of every frame from start to end:
+    blender -b MyProject.blend --python resources/export_sequence.py -- Cube /path/to/folder [start end]
+"""
+
+import addon_utils
+import bpy
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+addon_utils.enable("stop_motion", default_set=True)
+
+from stop_motion import obj_io
+
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if len(argv) not in (2, 4):
+        sys.exit(__doc__)
+    name, directory = argv[:2]
+    frame_range = tuple(int(frame) for frame in argv[2:]) or None
+    print(obj_io.export_sequence(
+        bpy.data.objects[name], directory, frame_range=frame_range))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,18 +19,30 @@
 
 if "bpy" in locals():
     import importlib
+    importlib.reload(modifier_data)
     importlib.reload(animation)
+    importlib.reload(drawings)
+    importlib.reload(drawing_cache)
+    importlib.reload(lookup)
+    importlib.reload(library_storage)
     importlib.reload(ui)
     importlib.reload(modes)
     importlib.reload(obj_io)
     importlib.reload(onion_skins)
+    importlib.reload(point_cache)
     importlib.reload(preferences)
 else:
+    from . import modifier_data
     from . import animation
+    from . import drawings
+    from . import drawing_cache
+    from . import lookup
+    from . import library_storage
     from . import ui
     from . import modes
     from . import obj_io
     from . import onion_skins
+    from . import point_cache
     from . import preferences
 
 import bpy
@@ -70,10 +82,16 @@ def stop_motion_manual_map():
 
 def register():
     preferences.register()
+    modifier_data.register()
     modes.register()
     animation.register()
+    lookup.register()
+    library_storage.register()
+    drawings.register()
     obj_io.register()
+    drawing_cache.register()
     onion_skins.register()
+    point_cache.register()
     ui.register()
     bpy.utils.register_manual_map(stop_motion_manual_map)
 
@@ -81,10 +99,16 @@ def register():
 def unregister():
     bpy.utils.unregister_manual_map(stop_motion_manual_map)
     ui.unregister()
+    point_cache.unregister()
     onion_skins.unregister()
+    drawing_cache.unregister()
     obj_io.unregister()
+    drawings.unregister()
+    library_storage.unregister()
+    lookup.unregister()
     animation.unregister()
     modes.unregister()
+    modifier_data.unregister()
     preferences.unregister()
 
 
@@ -19,21 +19,22 @@
 
 if "bpy" in locals():
     import importlib
-    importlib.reload(json_nodes)
+    importlib.reload(drawings)
     importlib.reload(modifier_data)
     importlib.reload(modes)
+    importlib.reload(node_library)
     importlib.reload(onion_skins)
     importlib.reload(version)
 else:
-    from . import json_nodes
+    from . import drawings
     from . import modifier_data
     from . import modes
+    from . import node_library
     from . import onion_skins
     from . import version
 
 import bpy
-import os
-from .modifier_data import Modifier, StopMotionOperator
+from .modifier_data import Modifier, StopMotionOperator, is_stop_motion
 
 
 class OBJECT_OT_add_stop_motion(bpy.types.Operator):
@@ -42,10 +43,13 @@ class OBJECT_OT_add_stop_motion(bpy.types.Operator):
     bl_label = "Add Stop Motion Object"
     bl_options = {'REGISTER', 'UNDO'}
 
+    lookup: bpy.props.EnumProperty(
+        name="Lookup", items=modifier_data.LOOKUP_ITEMS, default='COLLECTION')
+
     @classmethod
     def poll(cls, context):
         obj = context.object
-        return obj and obj.type == 'MESH' and not Modifier(obj)
+        return obj and obj.type == 'MESH' and not is_stop_motion(obj)
 
     def execute(self, context):
 
@@ -63,12 +67,13 @@ class OBJECT_OT_add_stop_motion(bpy.types.Operator):
 
         first_frame = stop_motion_object.copy()
 
-        # Create and Populate Modifiers
-        for name, json_path, modname in (
-                ("MeshKey", "modifier.json", Modifier.name),
-                ("Realize", "realizer.json", "Realizer")):
-            node_group = json_nodes.read_node(
-                name, os.path.join(os.path.dirname(__file__), json_path))
+        # Create and Populate Modifiers, appending groups in one go
+        node_library.ensure_groups(
+            (modifier_data.LOOKUPS[self.lookup], "Realize"))
+        for name, modname in (
+                (modifier_data.LOOKUPS[self.lookup], Modifier.name),
+                ("Realize", "Realizer")):
+            node_group = node_library.read_group(name)
             modifier = stop_motion_object.modifiers.new(modname, 'NODES')
             modifier.node_group = node_group
         # Don't show realize in viewport by default
@@ -85,7 +90,9 @@ class OBJECT_OT_add_stop_motion(bpy.types.Operator):
             c for c in bpy.data.collections if first_frame.name in c]
         for c in old_collections:
             c.objects.unlink(first_frame)
+        modifier_data.tag_drawing(first_frame, 0)
         stop_motion_collection.objects.link(first_frame)
+        modifier.sync_drawing()
         version.main_tag(stop_motion_object)
         return {'FINISHED'}
 
@@ -93,7 +100,7 @@ class OBJECT_OT_add_stop_motion(bpy.types.Operator):
 
 
 def insert_keyframe(context, source_data, use_copy=False):
-    """ Appends a keyshape at end; doesn't disrupt the alphabetical order """
+    """ Appends a keyshape at end, with an index past all others """
     obj = context.object
     if not obj:
         return
@@ -104,25 +111,81 @@ def insert_keyframe(context, source_data, use_copy=False):
     modes.set_object(mode)
 
     collection = modifier.collection
-    index = len(collection.objects)
+    index = modifier.next_index()
     newest = modifier.object_name(index=index)
+    widen = modifier.name_digits(index) > modifier.name_digits()
 
+    current = modifier.get_object()
+    # Packed drawings stay packed, we get a mesh of our own to work with
+    packed = bool(current.get(modifier_data.PACKED_PROP))
+    current_data = (
+        modifier_data.unpacked_mesh(current) if packed else current.data)
     if not source_data:
-        source_data = modifier.get_object().data
-        use_copy = True # Always copy the current shape if keyframing it
-
-    shape_data = source_data.copy() if use_copy else source_data
+        source_data = current_data
+        use_copy = not packed # Always copy the current shape if keyframing it
+
+    preferences = context.preferences.addons[__package__].preferences
+    if (
+            use_copy and not packed and mode == 'OBJECT'
+            and not current_data.library and preferences.deduplicate_on_insert
+            and drawings.same_content(source_data, current_data)):
+        # Copied on write by the mode switcher / updater
+        shape_data = drawings.share(current_data)
+    else:
+        shape_data = source_data.copy() if use_copy else source_data
+    if packed and shape_data != current_data:
+        bpy.data.meshes.remove(current_data)
     shape_ob = bpy.data.objects.new(name=newest, object_data=shape_data)
+    modifier_data.tag_drawing(shape_ob, index)
 
     collection.objects.link(shape_ob)
+    if widen:
+        modifier.rename_drawings()
     modifier.index = index
     modifier.keyframe_index(context)
+    modifier.sync_drawing()
 
     obj.data = shape_ob.data
-    onion_skins.sync_onion_skins(context.scene, obj)
+    onion_skins.sync_scene_onion_skins(context.scene)
     modes.restore(mode, obj)
 
 
+def insert_keyframes(context, items, use_copy=True):
+    """ Append one drawing per (mesh, frame) with a single mode switch, one
+    bulk keyframe write and one onion skin sync """
+    obj = context.object
+    if not obj or not is_stop_motion(obj) or not items:
+        return
+    modifier = Modifier(obj)
+    mode = obj.mode
+    modes.set_object(mode)
+
+    collection = modifier.collection
+    first = modifier.next_index()
+    widen = modifier.name_digits(first + len(items) - 1) > modifier.name_digits()
+    keys = []
+    for index, (mesh, frame) in enumerate(items, start=first):
+        shape_ob = bpy.data.objects.new(
+            name=modifier.object_name(index=index),
+            object_data=mesh.copy() if use_copy else mesh)
+        modifier_data.tag_drawing(shape_ob, index)
+        collection.objects.link(shape_ob)
+        keys.append((frame, index))
+    if widen:
+        modifier.rename_drawings()
+    try:
+        modifier.keyframe_indices(keys)
+    finally:
+        modifier.index = modifier.index_at(context.scene.frame_current)
+        modifier.sync_drawing()
+        drawing = modifier.get_object()
+        # Sub-object modes edit the data, which mustn't be shared
+        obj.data = (
+            drawing.data if mode == 'OBJECT' else modifier_data.unshare(drawing))
+        onion_skins.sync_scene_onion_skins(context.scene)
+        modes.restore(mode, obj)
+
+
 class OBJECT_OT_keyframe_stop_motion(StopMotionOperator):
     """Add a key drawing/ frame, optionally from selection"""
     bl_idname = "object.keyframe_stop_motion"
@@ -142,6 +205,42 @@ class OBJECT_OT_keyframe_stop_motion(StopMotionOperator):
         return {'FINISHED'}
 
 
+class OBJECT_OT_keyframe_stop_motion_batch(StopMotionOperator):
+    """Add every selected mesh as a key drawing, in name order, starting
+    at the current frame"""
+    bl_idname = "object.keyframe_stop_motion_batch"
+    bl_label = "Keyframe Selected"
+
+    frame_step: bpy.props.IntProperty(
+        name="Frame Step", description="Frames between drawings",
+        default=2, min=1, soft_max=10)
+    use_copy: bpy.props.BoolProperty(default=True)
+
+    @classmethod
+    def poll(cls, context):
+        return (
+            StopMotionOperator.poll(context)
+            and len(context.selected_objects) > 1)
+
+    def execute(self, context):
+        stop_motion_object = context.object
+        sources = sorted(
+            (o for o in context.selected_objects
+            if o is not stop_motion_object and o.type == 'MESH'),
+            key=lambda o: o.name)
+        start = context.scene.frame_current
+        try:
+            insert_keyframes(
+                context,
+                [(o.data, start + i * self.frame_step) for i, o in enumerate(sources)],
+                use_copy=self.use_copy)
+        except RuntimeError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Keyed {len(sources)} drawings")
+        return {'FINISHED'}
+
+
 class OBJECT_OT_Join_keyframe_stop_motion(StopMotionOperator):
     """Join Selected Meshes into a new keyframe"""
     bl_idname = "object.join_stop_motion"
@@ -205,6 +304,7 @@ class SCREEN_OT_next_or_add_key(bpy.types.Operator):
 def register():
     bpy.utils.register_class(OBJECT_OT_add_stop_motion) # Create and Initialize
     bpy.utils.register_class(OBJECT_OT_keyframe_stop_motion) # Insert New Key
+    bpy.utils.register_class(OBJECT_OT_keyframe_stop_motion_batch)
     bpy.utils.register_class(SCREEN_OT_next_or_add_key)
     bpy.utils.register_class(OBJECT_OT_Join_keyframe_stop_motion)
 
@@ -213,6 +313,7 @@ def unregister():
     bpy.utils.unregister_class(OBJECT_OT_add_stop_motion)
     bpy.utils.unregister_class(SCREEN_OT_next_or_add_key)
     bpy.utils.unregister_class(OBJECT_OT_keyframe_stop_motion)
+    bpy.utils.unregister_class(OBJECT_OT_keyframe_stop_motion_batch)
     bpy.utils.unregister_class(OBJECT_OT_Join_keyframe_stop_motion)
 
 if __name__ == "__main__":
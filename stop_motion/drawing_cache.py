@@ -0,0 +1,251 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Drawings written to and read back from the binary drawing cache (see
+mesh_io), keeping edges, UVs, colors and every other mesh attribute
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(animation)
+    importlib.reload(drawings)
+    importlib.reload(mesh_io)
+    importlib.reload(modifier_data)
+    importlib.reload(modes)
+    importlib.reload(obj_io)
+else:
+    from . import animation
+    from . import drawings
+    from . import mesh_io
+    from . import modifier_data
+    from . import modes
+    from . import obj_io
+
+import bpy
+import numpy
+from .modifier_data import Modifier, StopMotionOperator
+
+
+def cached_attributes(mesh):
+    """ Attributes to keep: not positions, internal or packed drawings """
+    return [
+        attribute for attribute in mesh.attributes
+        if attribute.data_type in drawings.ATTRIBUTE_TYPES
+        and attribute.name != "position"
+        and not attribute.name.startswith(".")
+        and not attribute.name.startswith(modifier_data.PACKED_PREFIX)]
+
+
+def drawing_arrays(drawing):
+    """ (info, arrays) of a drawing for mesh_io.write_cache """
+    mesh = drawing.data
+    buffers = obj_io.drawing_buffers(drawing, use_uvs=False)
+    arrays = {
+        "positions": buffers.positions,
+        "edges": drawings.read(
+            mesh.edges, "vertices", numpy.int32, 2).reshape(-1, 2),
+        "loops": buffers.loops,
+        "loop_edges": drawings.read(mesh.loops, "edge_index", numpy.int32, 1),
+        "loop_starts": buffers.loop_starts,
+        }
+    attributes = []
+    for number, attribute in enumerate(cached_attributes(mesh)):
+        prop, dtype, size = drawings.ATTRIBUTE_TYPES[attribute.data_type]
+        arrays[f"attribute_{number}"] = drawings.read(
+            attribute.data, prop, dtype, size)
+        attributes.append((attribute.name, attribute.domain, attribute.data_type))
+    uv_layer = mesh.uv_layers.active
+    info = {
+        "name": mesh.name,
+        "attributes": attributes,
+        "materials": [material.name if material else "" for material in mesh.materials],
+        "uv_map": uv_layer.name if uv_layer else "",
+        "color": mesh.color_attributes.active_color_name or "",
+        }
+    return info, arrays
+
+
+def export_cache(obj, path, frame_range=None):
+    """ Write each drawing shown (by a key, or on a frame of frame_range)
+    once, with the frame table pointing at them """
+    modifier = Modifier(obj)
+    if modifier.collection is None:
+        raise KeyError(f"{obj.name} has no drawings")
+    frames = obj_io.sequence_frames(modifier, frame_range)
+    cached = {}
+    for index in sorted(set(frames.values())):
+        drawing = modifier.get_object(index)
+        if drawing.type != 'MESH':
+            raise KeyError(f"{drawing.name} is not a mesh drawing")
+        cached[index] = drawing_arrays(drawing)
+    mesh_io.write_cache(path, frames, cached)
+
+
+def mesh_from_cache(cache, index):
+    """ New mesh of one cached drawing, set straight from the mapped file """
+    info = cache.info(index)
+    arrays = cache.arrays(index)
+    mesh = bpy.data.meshes.new(info["name"])
+    mesh.vertices.add(len(arrays["positions"]))
+    mesh.vertices.foreach_set("co", arrays["positions"].ravel())
+    mesh.edges.add(len(arrays["edges"]))
+    mesh.edges.foreach_set("vertices", arrays["edges"].ravel())
+    mesh.loops.add(len(arrays["loops"]))
+    mesh.loops.foreach_set("vertex_index", arrays["loops"])
+    mesh.polygons.add(len(arrays["loop_starts"]))
+    mesh.polygons.foreach_set("loop_start", arrays["loop_starts"])
+    if "loop_edges" in arrays:
+        # Calculating edges may reorder them, edge attributes need ours
+        mesh.loops.foreach_set("edge_index", arrays["loop_edges"])
+        mesh.update()
+    else:
+        mesh.update(calc_edges=True)
+    for number, (name, domain, data_type) in enumerate(info["attributes"]):
+        attribute = mesh.attributes.get(name) or mesh.attributes.new(
+            name, data_type, domain)
+        prop = drawings.ATTRIBUTE_TYPES[data_type][0]
+        attribute.data.foreach_set(prop, arrays[f"attribute_{number}"].ravel())
+    if info["uv_map"] in mesh.uv_layers:
+        mesh.uv_layers.active = mesh.uv_layers[info["uv_map"]]
+    if info["color"] in mesh.color_attributes:
+        mesh.color_attributes.active_color_name = info["color"]
+    for name in info["materials"]:
+        mesh.materials.append(bpy.data.materials.get(name))
+    return mesh
+
+
+def import_cache(context, path, current_only=False):
+    """ Key cached drawings on their cached frames (or only the one cached
+    for the current frame) into the active object, return how many """
+    cache = mesh_io.DrawingCache(path)
+    scene = context.scene
+    if current_only:
+        index = cache.index_at(scene.frame_current)
+        if index is None:
+            return 0
+        animation.insert_keyframe(
+            context, mesh_from_cache(cache, index), use_copy=False)
+        return 1
+    obj = context.object
+    modifier = Modifier(obj)
+    first = modifier.next_index()
+    new_indices = {}
+    items = []
+    repeats = [] # Keys showing a drawing that was already keyed
+    for frame, index in cache.frames:
+        if index in new_indices:
+            repeats.append((frame, new_indices[index]))
+            continue
+        new_indices[index] = first + len(items)
+        items.append((mesh_from_cache(cache, index), frame))
+    animation.insert_keyframes(context, items, use_copy=False)
+    if repeats:
+        mode = obj.mode
+        modes.set_object(mode)
+        try:
+            modifier.keyframe_indices(repeats)
+        finally:
+            modifier.index = modifier.index_at(scene.frame_current)
+            modifier.sync_drawing()
+            drawing = modifier.get_object()
+            obj.data = (
+                drawing.data if mode == 'OBJECT' else modifier_data.unshare(drawing))
+            modes.restore(mode, obj)
+    return len(items)
+
+
+class OBJECT_OT_export_stop_motion_drawings(StopMotionOperator):
+    """Export drawings with all their attributes to a binary drawing cache"""
+    bl_idname = "object.export_stop_motion_drawings"
+    bl_label = "Export Drawing Cache"
+    bl_options = {'REGISTER'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    filter_glob: bpy.props.StringProperty(
+        default=f"*{mesh_io.CACHE_EXTENSION}", options={'HIDDEN'})
+    use_frame_range: bpy.props.BoolProperty(
+        name="Scene Frame Range",
+        description="Cache the drawing of every frame in the scene range "
+        "instead of every keyed drawing", default=False)
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = f"{context.object.name}{mesh_io.CACHE_EXTENSION}"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        filepath = bpy.path.ensure_ext(
+            bpy.path.abspath(self.filepath), mesh_io.CACHE_EXTENSION)
+        frame_range = (
+            (scene.frame_start, scene.frame_end) if self.use_frame_range else None)
+        mode = context.object.mode
+        modes.set_object(mode) # Edit mode changes aren't in the mesh yet
+        try:
+            export_cache(context.object, filepath, frame_range)
+        except (KeyError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        finally:
+            modes.restore(mode, context.object)
+        self.report({'INFO'}, f"Wrote {filepath}")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_import_stop_motion_drawings(StopMotionOperator):
+    """Key drawings from a binary drawing cache, reading only what's used"""
+    bl_idname = "object.import_stop_motion_drawings"
+    bl_label = "Import Drawing Cache"
+    bl_options = {'REGISTER'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    filter_glob: bpy.props.StringProperty(
+        default=f"*{mesh_io.CACHE_EXTENSION}", options={'HIDDEN'})
+    current_only: bpy.props.BoolProperty(
+        name="Current Frame Only",
+        description="Only load the drawing cached for the current frame",
+        default=False)
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        try:
+            count = import_cache(
+                context, bpy.path.abspath(self.filepath), self.current_only)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if not count:
+            self.report({'WARNING'}, "Nothing cached for this frame")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Imported {count} drawings")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(OBJECT_OT_export_stop_motion_drawings)
+    bpy.utils.register_class(OBJECT_OT_import_stop_motion_drawings)
+
+
+def unregister():
+    bpy.utils.unregister_class(OBJECT_OT_import_stop_motion_drawings)
+    bpy.utils.unregister_class(OBJECT_OT_export_stop_motion_drawings)
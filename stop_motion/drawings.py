@@ -0,0 +1,407 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Drawing storage maintenance
+
+Every keyframe stores its own mesh in the source collection; these tools
+keep that collection from growing with data nobody can see.
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(modifier_data)
+    importlib.reload(modes)
+    importlib.reload(node_library)
+    importlib.reload(version)
+else:
+    from . import modifier_data
+    from . import modes
+    from . import node_library
+    from . import version
+
+import bpy
+import hashlib
+import numpy
+from .modifier_data import Modifier, StopMotionOperator
+
+# Attribute data type: (foreach property, numpy type, values per element)
+ATTRIBUTE_TYPES = {
+    'FLOAT': ("value", numpy.float32, 1),
+    'INT': ("value", numpy.int32, 1),
+    'FLOAT_VECTOR': ("vector", numpy.float32, 3),
+    'FLOAT_COLOR': ("color", numpy.float32, 4),
+    'BYTE_COLOR': ("color", numpy.float32, 4),
+    'BOOLEAN': ("value", numpy.bool_, 1),
+    'FLOAT2': ("vector", numpy.float32, 2),
+    'INT8': ("value", numpy.int32, 1), # RNA ints, int8 buffers aren't bulk read
+    'INT32_2D': ("value", numpy.int32, 2),
+    'QUATERNION': ("value", numpy.float32, 4),
+    }
+
+# Topology: (mesh collection, foreach property, values per element)
+TOPOLOGY = (
+    ("edges", "vertices", 2),
+    ("loops", "vertex_index", 1),
+    ("polygons", "loop_start", 1),
+    )
+
+
+def read(collection, prop, dtype, size):
+    """Bulk read a property of a bpy collection into a flat array"""
+    buffer = numpy.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(prop, buffer)
+    return buffer
+
+
+def topology_buffers(mesh):
+    """Arrays that describe the mesh connectivity"""
+    for collection, prop, size in TOPOLOGY:
+        yield read(getattr(mesh, collection), prop, numpy.int32, size)
+
+
+def content_buffers(mesh, positions=True):
+    """(label, array) for everything that makes a drawing look the way it
+    does, except internal (dot prefixed) attributes like selection"""
+    if positions:
+        yield "position", read(mesh.vertices, "co", numpy.float32, 3)
+    for attribute in sorted(mesh.attributes, key=lambda a: a.name):
+        if attribute.name.startswith(".") or attribute.name == "position":
+            continue
+        if attribute.name.startswith(modifier_data.PACKED_PREFIX):
+            continue
+        attribute_type = ATTRIBUTE_TYPES.get(attribute.data_type)
+        if not attribute_type:
+            continue # e.g. strings, can't be read in bulk
+        label = f"{attribute.name}:{attribute.domain}:{attribute.data_type}"
+        yield label, read(attribute.data, *attribute_type)
+    if mesh.shape_keys:
+        for key_block in mesh.shape_keys.key_blocks:
+            yield (
+                f"shape:{key_block.name}",
+                read(key_block.data, "co", numpy.float32, 3))
+
+
+def mesh_hash(mesh, topology_only=False, positions=True):
+    """Return (digest, bytes read) of a mesh's content"""
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    counts = numpy.array(
+        [len(mesh.vertices), len(mesh.edges), len(mesh.loops),
+        len(mesh.polygons)], dtype=numpy.int64)
+    digest.update(counts.tobytes())
+    buffers = [("topology", buffer) for buffer in topology_buffers(mesh)]
+    if not topology_only:
+        buffers.extend(content_buffers(mesh, positions=positions))
+        digest.update(
+            "|".join(m.name if m else "" for m in mesh.materials).encode())
+    for label, buffer in buffers:
+        digest.update(label.encode())
+        digest.update(buffer.tobytes())
+        size += buffer.nbytes
+    return digest.hexdigest(), size
+
+
+def same_content(mesh, other):
+    """True if both meshes would draw the same"""
+    return mesh == other or mesh_hash(mesh)[0] == mesh_hash(other)[0]
+
+
+def share(mesh):
+    """Flag a mesh used by several drawings so it's copied before edits"""
+    mesh[modifier_data.SHARED_PROP] = True
+    return mesh
+
+
+def deduplicate(collection):
+    """Make identical drawings share one mesh: (meshes removed, bytes)"""
+    canonical = {}
+    removed = 0
+    reclaimed = 0
+    for drawing in sorted(collection.objects, key=lambda o: o.name):
+        mesh = drawing.data
+        if mesh is None or drawing.type != 'MESH':
+            continue
+        digest, size = mesh_hash(mesh)
+        original = canonical.setdefault(digest, mesh)
+        if original == mesh:
+            continue
+        share(original)
+        # Catches the stop motion object and onion skins as well
+        mesh.user_remap(original)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+            removed += 1
+            reclaimed += size
+    return removed, reclaimed
+
+
+def packable(drawing):
+    mesh = drawing.data
+    return (
+        drawing.type == 'MESH' and mesh and not mesh.shape_keys
+        and not drawing.get(modifier_data.PACKED_PROP))
+
+
+def unpack_modifier(drawing, attribute):
+    """Drawings evaluate their own positions, so both lookups keep working"""
+    modifier = drawing.modifiers.new(modifier_data.UNPACK_MODIFIER, 'NODES')
+    modifier.node_group = node_library.read_group("Unpack")
+    identifier = modifier.node_group.interface.items_tree['Attribute'].identifier
+    modifier[identifier] = attribute
+
+
+def pack(collection, stop_motion_object):
+    """Store drawings that only differ in positions as one base mesh plus
+    one position attribute each: (drawings packed, bytes before, after)"""
+    layouts = {}
+    for drawing in sorted(collection.objects, key=lambda o: o.name):
+        if packable(drawing):
+            digest = mesh_hash(drawing.data, positions=False)[0]
+            layouts.setdefault(digest, []).append(drawing)
+    packed = before = after = 0
+    for layout, members in layouts.items():
+        if len(members) < 2:
+            continue
+        base = members[0].data.copy()
+        base.pop(modifier_data.SHARED_PROP, None) # Packing shares it anyway
+        base.name = f"{version.NAME}_packed_{stop_motion_object.name}"
+        after += mesh_hash(base)[1]
+        # Read everything first, deduplicated drawings share meshes and
+        # remapping one would move the others onto the base too
+        positions = [
+            read(drawing.data.vertices, "co", numpy.float32, 3)
+            for drawing in members]
+        meshes = {drawing.data for drawing in members}
+        for drawing, drawing_positions in zip(members, positions):
+            attribute = f"{modifier_data.PACKED_PREFIX}{drawing.name}"
+            base.attributes.new(attribute, 'FLOAT_VECTOR', 'POINT').data.foreach_set(
+                "vector", drawing_positions)
+            after += drawing_positions.nbytes
+            drawing.data = base
+            drawing[modifier_data.PACKED_PROP] = attribute
+            unpack_modifier(drawing, attribute)
+            packed += 1
+        for mesh in meshes:
+            before += mesh_hash(mesh)[1]
+            mesh.user_remap(base) # The stop motion object and onion skins
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+    return packed, before, after
+
+
+def unpack(collection):
+    """Give every packed drawing its own mesh again, return how many"""
+    packed = [
+        drawing for drawing in collection.objects
+        if drawing.get(modifier_data.PACKED_PROP)]
+    # One copy of each base without the packed positions, instead of copying
+    # every drawing's positions along for each drawing
+    templates = {}
+    for drawing in packed:
+        base = drawing.data
+        if base not in templates:
+            templates[base] = modifier_data.unpacked_copy(base)
+        modifier_data.unpack(drawing, template=templates[base])
+    for base, template in templates.items():
+        bpy.data.meshes.remove(template)
+        if base.users == 0:
+            bpy.data.meshes.remove(base)
+    return len(packed)
+
+
+def compact(stop_motion_object):
+    """Remove drawings no key refers to and renumber the rest from zero:
+    (drawings removed, drawings kept)"""
+    modifier = Modifier(stop_motion_object)
+    fcurves = modifier.index_fcurves()
+    keys = [read(f.keyframe_points, "co", numpy.float32, 2) for f in fcurves]
+    used = {modifier.index}
+    for co in keys:
+        used.update(numpy.unique(numpy.rint(co[1::2]).astype(numpy.int64)).tolist())
+
+    drawings = modifier.drawings()
+    survivors = sorted(index for index in drawings if index in used)
+    removed = 0
+    for index, drawing in drawings.items():
+        if index in used:
+            continue
+        mesh = drawing.data
+        attribute = drawing.get(modifier_data.PACKED_PROP)
+        if attribute and attribute in mesh.attributes:
+            mesh.attributes.remove(mesh.attributes[attribute])
+        bpy.data.objects.remove(drawing)
+        if mesh and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+        removed += 1
+
+    # Renumber in two passes so new names never collide with old ones
+    for index in survivors:
+        drawings[index].name = f"{drawings[index].name}.compact"
+    for new_index, index in enumerate(survivors):
+        drawings[index].name = modifier.object_name(new_index)
+        modifier_data.tag_drawing(drawings[index], new_index)
+    modifier_data.invalidate_drawing_maps()
+
+    # One vectorized remap of every key, values without a drawing are kept
+    remap = numpy.arange(max(used) + 1 if used else 1)
+    remap[survivors] = numpy.arange(len(survivors))
+    for fcurve, co in zip(fcurves, keys):
+        values = numpy.rint(co[1::2]).astype(numpy.int64)
+        inside = (values >= 0) & (values < len(remap))
+        values[inside] = remap[values[inside]]
+        co[1::2] = values
+        points = fcurve.keyframe_points
+        points.foreach_set("co", co)
+        for handle in ("handle_left", "handle_right"):
+            handles = read(points, handle, numpy.float32, 2)
+            handles[1::2] = values
+            points.foreach_set(handle, handles)
+        fcurve.update()
+    if 0 <= modifier.index < len(remap):
+        modifier.index = int(remap[modifier.index])
+    modifier_data.invalidate_timelines()
+    modifier.sync_drawing()
+    return removed, len(survivors)
+
+
+def refuse_offloaded(operator, obj):
+    """ Report and return True when obj's drawings are offloaded: these
+    operations would only see the linked ones and can't edit those """
+    if not modifier_data.is_offloaded(Modifier(obj).collection):
+        return False
+    operator.report(
+        {'WARNING'}, f"{obj.name} is offloaded, bring its drawings back first")
+    return True
+
+
+class OBJECT_OT_stop_motion_compact(StopMotionOperator):
+    """Delete drawings no keyframe uses and renumber the rest"""
+    bl_idname = "object.stop_motion_compact"
+    bl_label = "Remove Unused Drawings"
+
+    def execute(self, context):
+        stop_motion_object = context.object
+        if refuse_offloaded(self, stop_motion_object):
+            return {'CANCELLED'}
+        mode = stop_motion_object.mode
+        modes.set_object(mode)
+        removed, kept = compact(stop_motion_object)
+        current = Modifier(stop_motion_object).get_object()
+        if mode == 'OBJECT':
+            stop_motion_object.data = current.data
+        else:
+            stop_motion_object.data = modifier_data.unshare(current)
+        modes.restore(mode, stop_motion_object)
+        self.report({'INFO'}, f"Removed {removed} drawings, kept {kept}")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_stop_motion_migrate(bpy.types.Operator):
+    """Store drawing indices on drawings of files saved by older versions"""
+    bl_idname = "object.stop_motion_migrate"
+    bl_label = "Migrate Drawing Indices"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        tagged = sum(
+            modifier_data.migrate_drawings(collection)
+            for collection in bpy.data.collections
+            if version.is_main(collection) and not collection.library)
+        self.report({'INFO'}, f"Tagged {tagged} drawings")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_stop_motion_storage(StopMotionOperator):
+    """Pack same topology drawings into one mesh, or unpack them again"""
+    bl_idname = "object.stop_motion_storage"
+    bl_label = "Drawing Storage"
+
+    storage: bpy.props.EnumProperty(
+        name="Storage",
+        items=[
+            ('PACKED', "Packed", "Same topology drawings share one mesh "
+            "storing only their positions"),
+            ('MESHES', "Meshes", "Every drawing has a mesh of its own")],
+        default='PACKED')
+
+    def execute(self, context):
+        stop_motion_object = context.object
+        if refuse_offloaded(self, stop_motion_object):
+            return {'CANCELLED'}
+        mode = stop_motion_object.mode
+        modes.set_object(mode)
+        modifier = Modifier(stop_motion_object)
+        collection = modifier.collection
+        if self.storage == 'PACKED':
+            packed, before, after = pack(collection, stop_motion_object)
+            self.report(
+                {'INFO'},
+                f"Packed {packed} drawings: {before / 2 ** 20:.2f} MiB "
+                f"to {after / 2 ** 20:.2f} MiB")
+        else:
+            self.report({'INFO'}, f"Unpacked {unpack(collection)} drawings")
+        current = modifier.get_object()
+        if mode == 'OBJECT':
+            stop_motion_object.data = current.data
+        else:
+            stop_motion_object.data = modifier_data.unshare(current)
+        modes.restore(mode, stop_motion_object)
+        return {'FINISHED'}
+
+
+class OBJECT_OT_stop_motion_deduplicate(StopMotionOperator):
+    """Share one mesh between identical drawings to save memory"""
+    bl_idname = "object.stop_motion_deduplicate"
+    bl_label = "Deduplicate Drawings"
+
+    def execute(self, context):
+        stop_motion_object = context.object
+        if refuse_offloaded(self, stop_motion_object):
+            return {'CANCELLED'}
+        mode = stop_motion_object.mode
+        modes.set_object(mode)
+        modifier = Modifier(stop_motion_object)
+        removed, reclaimed = deduplicate(modifier.collection)
+        if mode != 'OBJECT':
+            stop_motion_object.data = modifier_data.unshare(
+                modifier.get_object())
+        modes.restore(mode, stop_motion_object)
+        self.report(
+            {'INFO'},
+            f"Removed {removed} duplicate meshes, "
+            f"reclaimed {reclaimed / 2 ** 20:.2f} MiB")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(OBJECT_OT_stop_motion_deduplicate)
+    bpy.utils.register_class(OBJECT_OT_stop_motion_storage)
+    bpy.utils.register_class(OBJECT_OT_stop_motion_compact)
+    bpy.utils.register_class(OBJECT_OT_stop_motion_migrate)
+
+
+def unregister():
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_migrate)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_compact)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_storage)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_deduplicate)
+
+if __name__ == "__main__":
+    register()
@@ -18,15 +18,37 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
+import hashlib
 import json
 import os
+import zlib
 
 # TODO Save Metadata (type information, read only)
-# TODO Allow Saving multiple items in a single file
-# TODO Include Item type (e.g. GeometryNodeTree) in save so we can make code generic
 # TODO If None in a value, don't save (no point in setting it and we don't know type)
 # TODO Recursive
 
+# Bundles keep many groups in one file: a single line JSON header indexing
+# each group's tree type, digest and byte range, then the groups themselves
+BUNDLE_EXTENSION = ".nodes"
+BUNDLE_FORMAT = 1
+COMPRESSIONS = (None, "zlib")
+
+# Template digest stored on groups we build, to spot outdated ones
+HASH_PROP = "json_nodes_hash"
+
+# Parsed templates per path: (modification time, digest, tree data)
+templates = {}
+
+# Open bundles per path, see bundle()
+bundles = {}
+
+# Serializable property names per RNA type, in dir() order
+schemas = {}
+
+# How to sanitize values per Python type, see Node_Tree.sanitize
+SCALAR, SEQUENCE, FALLBACK, NAMED, OTHER = range(5)
+sanitizers = {}
+
 # Fallback Functions
 
 def is_socket(item):
@@ -51,55 +73,81 @@ class Node_Tree():
 
     fall_backs = {is_socket: get_socket_index}
 
-    def __init__(self, name, tree_data=None):
-        """ name is a node group's name, tree data is it's serial form """
+    def __init__(self, name, tree_data=None, data=None):
+        """ name is a node group's name, tree data is it's serial form, data
+        the BlendData to find or create it in (default bpy.data) """
         self.tree_data = tree_data
         self.name = name
-        self.node_group = bpy.data.node_groups.get(name)
-        if self.node_group:
+        self.data = data or bpy.data
+        self.node_group = self.data.node_groups.get(name)
+        if self.node_group and tree_data is None:
             self.serialize()
 
     def sanitize(self, datum, prin=""):
         """ Try to return something JSONable """
-        if type(datum) in (int, str, float, bool):
+        kind = sanitizers.get(type(datum))
+        if kind is None:
+            kind = sanitizers[type(datum)] = self.sanitizer(datum)
+        if kind == SCALAR:
             return datum
-        try:
-            iter(datum)
-        except TypeError:
+        if kind == SEQUENCE:
+            return [self.sanitize(item) for item in datum]
+        if kind == FALLBACK:
             for test, func in self.fall_backs.items():
                 if test(datum):
                     return func(datum)
+        if kind == NAMED:
+            return datum.name
+        return datum
+
+    def sanitizer(self, datum):
+        """ Probe a value once for its whole type """
+        if type(datum) in (int, str, float, bool):
+            return SCALAR
+        try:
+            iter(datum)
+        except TypeError:
+            if any(test(datum) for test in self.fall_backs):
+                return FALLBACK
             if 'name' in dir(datum):
-                return datum.name
-            return datum
-        return [self.sanitize(item) for item in datum]
+                return NAMED
+            return OTHER
+        return SEQUENCE
 
-    def include(self, data, prop):
-        """ whether or not to include a prop in serialization """
-        
+    def include(self, prop):
+        """ whether or not a property name can be serialized at all """
         if any(prop.startswith(pre) for pre in ("bl_", "_", "is_", "rna_")):
             return False
         if prop in self.exclusion:
             return False
-        value = getattr(data, prop)
-        if callable(value):
-            return False
-        if value is None:
-            return False
-
         return True
 
+    def schema(self, element):
+        """ Serializable property names of an element's RNA type, computed
+        once per type from bl_rna plus anything python adds, sorted like
+        dir() so output matches the old per element dir() scan """
+        rna_type = type(element)
+        props = schemas.get(rna_type)
+        if props is not None:
+            return props
+        names = {prop.identifier for prop in element.bl_rna.properties}
+        names.update(dir(rna_type))
+        props = schemas[rna_type] = [
+            prop for prop in sorted(names) if self.include(prop)
+            and not callable(getattr(element, prop, None))]
+        return props
+
     def serialize_element(self, element, additions=[]):
         """ Turn an element of a group into it's serialized representation """
-        props = (prop for prop in dir(element) if self.include(element, prop))
-        items = {
-            prop: self.sanitize(getattr(element, prop))
-            for prop in props
-            }
+        items = {}
+        for prop in self.schema(element):
+            value = getattr(element, prop)
+            if value is not None:
+                items[prop] = self.sanitize(value)
         for addition in additions:
             items[addition] = self.sanitize(getattr(element, addition))
         return items
-                
+
     def serialize_node(self, node): 
         """  Serialize a Node """
         io_props = {
@@ -115,7 +163,7 @@ class Node_Tree():
         for io, props in io_props.items():
             items[io] = [{
                     prop: self.sanitize(getattr(element, prop))
-                    for prop in props if prop in dir(element)}
+                    for prop in props if prop in self.schema(element)}
                 for element in getattr(node, io)] 
         return items
     
@@ -163,7 +211,7 @@ class Node_Tree():
         if self.node_group:
             return self.node_group
         
-        self.node_group = bpy.data.node_groups.new(
+        self.node_group = self.data.node_groups.new(
             self.name, tree_type)
         node_tree = self.node_group
 
@@ -218,26 +266,153 @@ def write_node(group_name, path):
         json_file.write(json.dumps(group_data))
         
         
-def read_node(group_name, path, tree_type="GeometryNodeTree"):
-    """ Return Serialized Node Group from JSON format """
-    return Node_Tree(
-        group_name,
-        tree_data=json.loads(open(path).read())
-        ).create(tree_type=tree_type)
+def template(path):
+    """ Parse a JSON resource once per session: (mtime, digest, data) """
+    mtime = os.path.getmtime(path)
+    cached = templates.get(path)
+    if cached and cached[0] == mtime:
+        return cached
+    with open(path) as json_file:
+        text = json_file.read()
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    templates[path] = (mtime, digest, json.loads(text))
+    return templates[path]
+
+
+def encode(tree_data):
+    """ Deterministic compact JSON of one group, the unit bundles store """
+    return json.dumps(
+        tree_data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def dump_bundle(path, groups, compression=None):
+    """ Write {name: (tree type, tree data)} as a bundle, sorted by name """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}")
+    index = {}
+    payloads = []
+    offset = 0
+    for name in sorted(groups):
+        tree_type, tree_data = groups[name]
+        payload = encode(tree_data)
+        digest = hashlib.sha1(payload).hexdigest()
+        if compression == "zlib":
+            payload = zlib.compress(payload, 9)
+        index[name] = {
+            "digest": digest, "length": len(payload), "offset": offset,
+            "tree_type": tree_type}
+        payloads.append(payload)
+        offset += len(payload)
+    header = {"compression": compression, "format": BUNDLE_FORMAT, "groups": index}
+    with open(path, 'wb') as bundle_file:
+        bundle_file.write(json.dumps(header, sort_keys=True).encode() + b"\n")
+        for payload in payloads:
+            bundle_file.write(payload)
+
+
+def write_bundle(group_names, path, compression=None):
+    """ Write Serialized Node Groups to a single bundle file """
+    dump_bundle(path, {
+        name: (bpy.data.node_groups[name].bl_idname, Node_Tree(name).tree_data)
+        for name in group_names}, compression=compression)
+
+
+class Bundle():
+    """ Bundle reader: the header is read up front, each group is only read
+    and parsed the first time it is asked for """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as bundle_file:
+            self.header = json.loads(bundle_file.readline())
+            self.start = bundle_file.tell()
+        if self.header.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format in {path}")
+        self.index = self.header["groups"]
+        self.parsed = {}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def digest(self, name):
+        return self.index[name]["digest"]
+
+    def tree_type(self, name):
+        return self.index[name]["tree_type"]
+
+    def tree_data(self, name):
+        tree_data = self.parsed.get(name)
+        if tree_data is not None:
+            return tree_data
+        entry = self.index[name]
+        with open(self.path, 'rb') as bundle_file:
+            bundle_file.seek(self.start + entry["offset"])
+            payload = bundle_file.read(entry["length"])
+        if self.header["compression"] == "zlib":
+            payload = zlib.decompress(payload)
+        tree_data = self.parsed[name] = json.loads(payload)
+        return tree_data
+
+
+def bundle(path):
+    """ Shared Bundle reader for path, reopened when the file changes """
+    mtime = os.path.getmtime(path)
+    cached = bundles.get(path)
+    if cached and cached.mtime == mtime:
+        return cached
+    bundles[path] = Bundle(path)
+    return bundles[path]
+
+
+def read_node(group_name, path, tree_type=None):
+    """ Return Node Group, only building it from JSON if it is missing or
+    was built from a different version of the template; path is either a
+    bundle or a single group JSON file """
+    if path.endswith(BUNDLE_EXTENSION):
+        source = bundle(path)
+        digest = source.digest(group_name)
+        tree_type = tree_type or source.tree_type(group_name)
+        tree_data = lambda: source.tree_data(group_name)
+    else:
+        mtime, digest, data = template(path)
+        tree_type = tree_type or "GeometryNodeTree"
+        tree_data = lambda: data
+    node_group = bpy.data.node_groups.get(group_name)
+    if node_group:
+        if node_group.library:
+            return node_group
+        stored = node_group.get(HASH_PROP)
+        if stored is None:
+            # Built before we kept digests, trust it like we used to
+            node_group[HASH_PROP] = digest
+            return node_group
+        if stored == digest:
+            return node_group
+        # Outdated: build a fresh one and move every user over
+        node_group.name = f"{group_name}.outdated"
+    new_group = Node_Tree(
+        group_name, tree_data=tree_data()).create(tree_type=tree_type)
+    new_group[HASH_PROP] = digest
+    if node_group:
+        node_group.user_remap(new_group)
+        bpy.data.node_groups.remove(node_group)
+    return new_group
 
 if __name__ == "__main__":
-    # Run this in resources/meshkey_devel.blend after tweaking MeshKey nodes
+    # Run this in resources/meshkey_devel.blend after tweaking the nodes;
+    # groups the file doesn't have are kept as they are in the bundle
     filepath = os.path.abspath(os.path.join(
         os.path.split(bpy.context.blend_data.filepath)[0],
-        "../stop_motion/modifier.json"
+        f"../stop_motion/node_groups{BUNDLE_EXTENSION}"
         ))
-    write_node("MeshKey", filepath)
-
-    filepath = filepath.replace("modifier.json", "realizer.json")
-    write_node("Realize", filepath)
-
-    filepath = filepath.replace("realizer.json", "materializer.json")
-    write_node("Materialize", filepath)
-
-    filepath = filepath.replace("materializer.json", "material.json")
-    write_node("Oniony", filepath)
+    existing = bundle(filepath)
+    dump_bundle(filepath, {
+        name: (
+            (bpy.data.node_groups[name].bl_idname, Node_Tree(name).tree_data)
+            if name in bpy.data.node_groups else
+            (existing.tree_type(name), existing.tree_data(name)))
+        for name in existing})
@@ -0,0 +1,468 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+External drawing storage
+
+Long takes can keep their drawings in chunks of library .blend files next
+to the main file (drawing index // chunk size picks the chunk), linked back
+into the source collection. Editing a linked drawing makes it local (see
+modifier_data.localize); saving writes only the chunks that have local
+drawings and links them back. Chunks are linked when frames near the
+current one need them and the rest are let go on save, so the main file
+only references what was in use.
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(lookup)
+    importlib.reload(modifier_data)
+    importlib.reload(version)
+else:
+    from . import lookup
+    from . import modifier_data
+    from . import version
+
+import bpy
+import os
+from bpy.app.handlers import persistent
+from .modifier_data import (
+    CHUNK_SIZE_PROP, INDEX_END_PROP, Modifier, StopMotionOperator,
+    is_offloaded, is_stop_motion)
+
+# On the source collection: {chunk: library path}
+CHUNKS_PROP = f"{version.NAME}_chunks"
+
+# Frames either side of the current one whose drawings stay linked
+WINDOW = 24
+
+# Chunk paths that failed to link, reported once until the next file load
+unreadable = set()
+
+# bpy.data collections a chunk can hold, users before what they use
+LOCALIZE_ORDER = (
+    "objects", "meshes", "materials", "node_groups", "textures", "images")
+
+
+def chunk_of(collection, index):
+    return index // collection[CHUNK_SIZE_PROP]
+
+
+def chunk_path(collection, chunk):
+    """ Absolute path of a chunk, existing or not """
+    path = collection.get(CHUNKS_PROP, {}).get(str(chunk))
+    if path:
+        return os.path.normpath(bpy.path.abspath(path))
+    blend = os.path.splitext(bpy.data.filepath)[0]
+    return os.path.join(f"{blend}_drawings", f"{collection.name}_{chunk:04}.blend")
+
+
+def linked_libraries():
+    """ {absolute path: Library} of every linked file """
+    return {
+        os.path.normpath(bpy.path.abspath(library.filepath)): library
+        for library in bpy.data.libraries}
+
+
+def chunk_libraries(collection):
+    """ {chunk: Library} of the linked chunks, found through their drawings
+    since Blender keeps library paths right when the file is saved
+    elsewhere, or through their written path when all were made local """
+    found = {}
+    for index, drawing in modifier_data.drawing_map(collection).items():
+        if drawing.library:
+            found.setdefault(chunk_of(collection, index), drawing.library)
+    libraries = linked_libraries()
+    for chunk in collection.get(CHUNKS_PROP, {}):
+        library = libraries.get(chunk_path(collection, int(chunk)))
+        if library:
+            found.setdefault(int(chunk), library)
+    return found
+
+
+def chunk_library(collection, chunk):
+    """ The Library datablock of a chunk if it is linked """
+    return chunk_libraries(collection).get(chunk)
+
+
+def chunk_drawings(collection):
+    """ {chunk: [drawing]} of the drawings in the collection """
+    chunks = {}
+    for index, drawing in modifier_data.drawing_map(collection).items():
+        chunks.setdefault(chunk_of(collection, index), []).append(drawing)
+    return chunks
+
+
+def link_chunk(collection, chunk):
+    """ Link a written chunk's drawings into the collection, leaving out
+    indices that are already there (e.g. edited, so local); raises OSError
+    when the chunk can't be read """
+    path = chunk_path(collection, chunk)
+    with bpy.data.libraries.load(path, link=True, relative=True) as (
+            data_from, data_to):
+        data_to.objects = list(data_from.objects)
+    present = modifier_data.drawing_map(collection)
+    for drawing in data_to.objects:
+        if drawing and drawing.get(modifier_data.INDEX_PROP) not in present:
+            collection.objects.link(drawing)
+    modifier_data.drawing_maps.pop(collection.as_pointer(), None)
+
+
+def try_link_chunk(collection, chunk):
+    """ link_chunk for handlers: a missing or unreadable chunk (moved
+    folder, deleted file) is reported once instead of on every frame """
+    path = chunk_path(collection, chunk)
+    if path in unreadable:
+        return False
+    try:
+        link_chunk(collection, chunk)
+    except OSError as e:
+        unreadable.add(path)
+        print(f"Warning: {collection.name} chunk {chunk}: {e}")
+        return False
+    return True
+
+
+def release_chunk(collection, chunk):
+    """ Let go of a linked chunk; local drawings in it stay """
+    library = chunk_library(collection, chunk)
+    if library:
+        bpy.data.libraries.remove(library)
+    modifier_data.drawing_maps.pop(collection.as_pointer(), None)
+
+
+def localize_library(library):
+    """ Make what is in use from a linked chunk local, users before what
+    they use so nothing gets copied; return [(bpy.data name, datablock)] """
+    localized = []
+    for name in LOCALIZE_ORDER:
+        for datablock in list(getattr(bpy.data, name)):
+            if datablock.library == library and datablock.users:
+                localized.append((name, datablock.make_local()))
+    return localized
+
+
+def remove_unused(localized):
+    """ Remove what localize_library made local and nothing uses anymore """
+    for name, datablock in localized:
+        try:
+            unused = not datablock.users
+        except ReferenceError:
+            continue # A drawing, already swapped for its link
+        if unused:
+            getattr(bpy.data, name).remove(datablock)
+
+
+def detach(drawings):
+    """ Local copies of what drawings use from other chunks (shared meshes,
+    materials), so that letting go of one chunk never breaks another """
+    copies = {}
+    for drawing in drawings:
+        mesh = drawing.data
+        if mesh.library:
+            if mesh not in copies:
+                copies[mesh] = mesh.copy()
+            drawing.data = copies[mesh]
+    for mesh in {drawing.data for drawing in drawings}:
+        for slot, material in enumerate(mesh.materials):
+            if material and material.library:
+                mesh.materials[slot] = (
+                    bpy.data.materials.get((material.name, None))
+                    or material.copy())
+
+
+def write_chunk(collection, chunk):
+    """ Rewrite a chunk from the drawings of it in the collection, then
+    swap the local ones for links to what was written """
+    path = chunk_path(collection, chunk)
+    library = chunk_library(collection, chunk)
+    if not library and str(chunk) in collection.get(CHUNKS_PROP, {}):
+        link_chunk(collection, chunk)
+        library = chunk_library(collection, chunk)
+    # Everything written must be local, or the chunk would link to itself
+    localized = []
+    if library:
+        localized = localize_library(library)
+        bpy.data.libraries.remove(library)
+    members = {
+        index: drawing
+        for index, drawing in modifier_data.drawing_map(collection).items()
+        if chunk_of(collection, index) == chunk}
+    for index, drawing in members.items():
+        modifier_data.tag_drawing(drawing, index)
+    if members:
+        collection[INDEX_END_PROP] = max(
+            collection.get(INDEX_END_PROP, 0), max(members) + 1)
+    drawings = list(members.values())
+    detach(drawings)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.tmp"
+    bpy.data.libraries.write(
+        temporary, {*drawings, *(drawing.data for drawing in drawings)},
+        path_remap='RELATIVE_ALL', fake_user=True, compress=True)
+    os.replace(temporary, path)
+    if CHUNKS_PROP not in collection:
+        collection[CHUNKS_PROP] = {}
+    collection[CHUNKS_PROP][str(chunk)] = bpy.path.relpath(path)
+
+    with bpy.data.libraries.load(path, link=True, relative=True) as (
+            data_from, data_to):
+        data_to.objects = list(data_from.objects)
+    linked = {
+        drawing.get(modifier_data.INDEX_PROP): drawing
+        for drawing in data_to.objects if drawing}
+    meshes = {}
+    for index, drawing in members.items():
+        new = linked[index]
+        meshes[drawing.data] = new.data
+        drawing.user_remap(new) # Collection, Object lookup socket etc.
+        bpy.data.objects.remove(drawing)
+    for mesh, new in meshes.items():
+        mesh.user_remap(new) # The stop motion object shows one of them
+        bpy.data.meshes.remove(mesh)
+    remove_unused(localized)
+    modifier_data.drawing_maps.pop(collection.as_pointer(), None)
+
+
+def flush(collection):
+    """ Write the chunks that have local drawings, return how many """
+    dirty = [
+        chunk for chunk, drawings in chunk_drawings(collection).items()
+        if any(not drawing.library for drawing in drawings)]
+    for chunk in dirty:
+        write_chunk(collection, chunk)
+    return len(dirty)
+
+
+def window_chunks(obj, frame):
+    """ Chunks holding the drawings shown within WINDOW frames of frame """
+    modifier = Modifier(obj)
+    collection = modifier.collection
+    return {
+        chunk_of(collection, modifier.index_at(near))
+        for near in range(frame - WINDOW, frame + WINDOW + 1)}
+
+
+def offloaded_objects(scene):
+    """ (stop motion object, source collection) of offloaded takes """
+    for obj in scene.objects:
+        if not is_stop_motion(obj) or obj.library:
+            continue
+        collection = Modifier(obj).collection
+        if is_offloaded(collection) and not collection.library:
+            yield obj, collection
+
+
+def linked_chunks(collection):
+    """ Chunks linked at their written path, cheap enough for every frame """
+    libraries = linked_libraries()
+    return {
+        int(chunk) for chunk in collection.get(CHUNKS_PROP, {})
+        if chunk_path(collection, int(chunk)) in libraries}
+
+
+def load_window(scene, everything=False):
+    """ Link the chunks frames around the current one need (or all) """
+    for obj, collection in offloaded_objects(scene):
+        written = {int(chunk) for chunk in collection.get(CHUNKS_PROP, {})}
+        needed = written if everything else (
+            window_chunks(obj, scene.frame_current) & written)
+        for chunk in needed - linked_chunks(collection):
+            try_link_chunk(collection, chunk)
+
+
+def drawing_materials(collection):
+    """ Names of the materials the drawings of a collection use """
+    return sorted({
+        material.name
+        for drawing in modifier_data.drawing_map(collection).values()
+        if drawing.type == 'MESH'
+        for material in drawing.data.materials if material})
+
+
+def offload(obj, chunk_size):
+    """ Move every drawing of obj out into chunk libraries; the Collection
+    lookup picks drawings by their position among the linked ones, so it
+    is switched to the Object lookup """
+    lookup.set_lookup(obj, 'OBJECT')
+    collection = Modifier(obj).collection
+    collection[CHUNK_SIZE_PROP] = chunk_size
+    return flush(collection)
+
+
+def bring_back(obj):
+    """ Make every drawing of obj local again and forget the chunks; every
+    chunk is linked first, so a missing one raises OSError before anything
+    changed """
+    collection = Modifier(obj).collection
+    chunks = [int(chunk) for chunk in collection.get(CHUNKS_PROP, {})]
+    for chunk in chunks:
+        if not chunk_library(collection, chunk):
+            link_chunk(collection, chunk)
+    for chunk in chunks:
+        library = chunk_library(collection, chunk)
+        localized = localize_library(library)
+        bpy.data.libraries.remove(library)
+        remove_unused(localized)
+    collection.pop(CHUNKS_PROP, None)
+    collection.pop(INDEX_END_PROP, None)
+    del collection[CHUNK_SIZE_PROP]
+    modifier_data.drawing_maps.pop(collection.as_pointer(), None)
+
+
+@persistent
+def storage_frame(scene, depsgraph=None):
+    """ Frame change handler, runs before the lookup one """
+    load_window(scene)
+
+
+@persistent
+def storage_render(scene, *args):
+    """ Renders get everything up front """
+    load_window(scene, everything=True)
+
+
+@persistent
+def storage_load(*args):
+    unreadable.clear()
+    for scene in bpy.data.scenes:
+        load_window(scene)
+
+
+def remap_chunks(collection, filepath):
+    """ Chunk paths relative to filepath, where the file is being saved;
+    Blender remaps library paths on Save As but not our property """
+    start = os.path.dirname(filepath)
+    libraries = chunk_libraries(collection)
+    chunks = collection.get(CHUNKS_PROP, {})
+    for chunk in list(chunks.keys()):
+        library = libraries.get(int(chunk))
+        path = (
+            os.path.normpath(bpy.path.abspath(library.filepath)) if library
+            else chunk_path(collection, int(chunk)))
+        chunks[chunk] = bpy.path.relpath(path, start=start)
+
+
+def save_chunks(obj, collection, frame):
+    """ Write dirty chunks and let go of the ones far from frame """
+    try:
+        flush(collection)
+    except OSError as e:
+        print(f"Warning: {collection.name} drawings not written: {e}")
+        return
+    if Modifier(obj).lookup != 'OBJECT':
+        return # Positions in the collection must stay as they are
+    keep = window_chunks(obj, frame)
+    for chunk in linked_chunks(collection) - keep:
+        release_chunk(collection, chunk)
+
+
+@persistent
+def storage_save(filepath="", *args):
+    """ Write dirty chunks and let go of the ones far from the current
+    frame so the file only references what is in use """
+    filepath = filepath or bpy.data.filepath
+    for scene in bpy.data.scenes:
+        for obj, collection in list(offloaded_objects(scene)):
+            if obj.mode == 'OBJECT': # Else its mesh is being edited, next save then
+                save_chunks(obj, collection, scene.frame_current)
+            remap_chunks(collection, filepath)
+
+
+class OBJECT_OT_stop_motion_offload(StopMotionOperator):
+    """Store drawings in external library files, linked back and only
+    loaded around the current frame"""
+    bl_idname = "object.stop_motion_offload"
+    bl_label = "Offload Drawings"
+    bl_options = {'REGISTER'}
+
+    chunk_size: bpy.props.IntProperty(
+        name="Chunk Size", description="Drawings per library file",
+        default=100, min=1, soft_max=1000)
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        if not context.blend_data.filepath:
+            self.report({'WARNING'}, "Save Blend file first")
+            return {'CANCELLED'}
+        obj = context.object
+        if obj.mode != 'OBJECT':
+            self.report({'WARNING'}, "Switch to Object Mode first")
+            return {'CANCELLED'}
+        collection = Modifier(obj).collection
+        if is_offloaded(collection):
+            self.report({'WARNING'}, f"{obj.name} is already offloaded")
+            return {'CANCELLED'}
+        # Linked meshes can't be pointed at our materials, they bring copies
+        materials = drawing_materials(collection)
+        try:
+            written = offload(obj, self.chunk_size)
+        except OSError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if materials:
+            self.report(
+                {'WARNING'}, f"Library files hold copies of {', '.join(materials)}; "
+                "edits to them only reach offloaded drawings when their chunk "
+                "is written again or brought back")
+        self.report({'INFO'}, f"Wrote {written} library files")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_stop_motion_bring_back(StopMotionOperator):
+    """Make offloaded drawings local to this file again"""
+    bl_idname = "object.stop_motion_bring_back"
+    bl_label = "Bring Back Drawings"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        obj = context.object
+        if not is_offloaded(Modifier(obj).collection):
+            self.report({'WARNING'}, f"{obj.name} isn't offloaded")
+            return {'CANCELLED'}
+        if obj.mode != 'OBJECT':
+            self.report({'WARNING'}, "Switch to Object Mode first")
+            return {'CANCELLED'}
+        try:
+            bring_back(obj)
+        except OSError as e:
+            self.report({'ERROR'}, f"Nothing brought back: {e}")
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(OBJECT_OT_stop_motion_offload)
+    bpy.utils.register_class(OBJECT_OT_stop_motion_bring_back)
+    # Drawings need to be there before lookups and onion skins look
+    bpy.app.handlers.frame_change_pre.insert(0, storage_frame)
+    bpy.app.handlers.render_init.append(storage_render)
+    bpy.app.handlers.load_post.append(storage_load)
+    bpy.app.handlers.save_pre.append(storage_save)
+
+
+def unregister():
+    bpy.app.handlers.save_pre.remove(storage_save)
+    bpy.app.handlers.load_post.remove(storage_load)
+    bpy.app.handlers.render_init.remove(storage_render)
+    bpy.app.handlers.frame_change_pre.remove(storage_frame)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_bring_back)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_offload)
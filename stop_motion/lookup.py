@@ -0,0 +1,154 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Drawing lookup modes
+
+The default MeshKey group instances the whole source collection and picks
+one child, so every frame costs as much as the number of drawings. The
+Object lookup group only ever sees one drawing; a frame change handler
+points it at the right one, which makes frame changes constant time at
+the price of needing the add-on for playback and rendering.
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(modifier_data)
+    importlib.reload(modes)
+    importlib.reload(node_library)
+    importlib.reload(version)
+else:
+    from . import modifier_data
+    from . import modes
+    from . import node_library
+    from . import version
+
+import bpy
+from bpy.app.handlers import persistent
+from .modifier_data import Modifier, StopMotionOperator, is_stop_motion
+
+
+def node_group(lookup):
+    """Get or create the MeshKey node group for a lookup mode"""
+    return node_library.read_group(modifier_data.LOOKUPS[lookup])
+
+
+def has_offloaded_drawings(obj):
+    """Offloaded takes only link some drawings, which the Collection
+    lookup would pick by the wrong position"""
+    return modifier_data.is_offloaded(Modifier(obj).collection)
+
+
+def set_lookup(obj, lookup):
+    """Swap the MeshKey group of obj, keeping collection and animation"""
+    modifier = Modifier(obj)
+    if not modifier or modifier.lookup == lookup:
+        return False
+    if lookup == 'COLLECTION' and has_offloaded_drawings(obj):
+        return False
+    collection = modifier.collection
+    index = modifier.index
+    old_path = modifier.fcurve_path
+
+    modifier.modifier.node_group = node_group(lookup)
+    if lookup == 'COLLECTION':
+        obj.pop(modifier_data.COLLECTION_PROP, None)
+
+    modifier = Modifier(obj)
+    modifier.collection = collection
+    if modifier.lookup == 'OBJECT':
+        # Don't leave the whole collection as a dependency of the modifier
+        modifier.modifier[modifier.__collection__] = None
+    modifier.index = index
+
+    new_path = modifier.fcurve_path
+    action = obj.animation_data.action if obj.animation_data else None
+    if action and new_path != old_path:
+        for fcurve in action.fcurves:
+            if fcurve.data_path == old_path:
+                fcurve.data_path = new_path
+        modifier_data.invalidate_timelines(action)
+    modifier.sync_drawing()
+    return True
+
+
+def sync_lookups(scene):
+    """Point every Object lookup modifier in scene at its current drawing,
+    onion skins follow their source in onion_skins.sync_skin_drawings"""
+    frame = scene.frame_current
+    for obj in scene.objects:
+        if not is_stop_motion(obj) or version.is_onion(obj):
+            continue
+        modifier = Modifier(obj)
+        if modifier.lookup != 'OBJECT':
+            continue
+        modifier.sync_drawing(modifier.index_at(frame))
+
+
+@persistent
+def stop_motion_lookup(scene, depsgraph=None):
+    """Frame change handler, runs before animation is evaluated"""
+    sync_lookups(scene)
+
+
+@persistent
+def stop_motion_lookup_load(*args):
+    """Make sure freshly loaded files show the right drawing"""
+    for scene in bpy.data.scenes:
+        sync_lookups(scene)
+
+
+class OBJECT_OT_stop_motion_lookup(StopMotionOperator):
+    """Change how the stop motion modifier finds the current drawing"""
+    bl_idname = "object.stop_motion_lookup"
+    bl_label = "Drawing Lookup"
+
+    lookup: bpy.props.EnumProperty(
+        name="Lookup", items=modifier_data.LOOKUP_ITEMS, default='OBJECT')
+
+    def execute(self, context):
+        stop_motion_object = context.object
+        objects = {stop_motion_object, *context.selected_objects}
+        mode = stop_motion_object.mode
+        modes.set_object(mode)
+        changed = [obj for obj in objects if set_lookup(obj, self.lookup)]
+        modes.restore(mode, stop_motion_object)
+        if self.lookup == 'COLLECTION':
+            for obj in objects:
+                if is_stop_motion(obj) and has_offloaded_drawings(obj):
+                    self.report(
+                        {'WARNING'}, f"{obj.name} is offloaded, "
+                        "bring its drawings back first")
+        self.report({'INFO'}, f"Changed lookup on {len(changed)} object(s)")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(OBJECT_OT_stop_motion_lookup)
+    bpy.app.handlers.frame_change_pre.append(stop_motion_lookup)
+    bpy.app.handlers.load_post.append(stop_motion_lookup_load)
+
+
+def unregister():
+    bpy.app.handlers.load_post.remove(stop_motion_lookup_load)
+    bpy.app.handlers.frame_change_pre.remove(stop_motion_lookup)
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_lookup)
+
+if __name__ == "__main__":
+    register()
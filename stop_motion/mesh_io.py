@@ -0,0 +1,468 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Mesh file parsing into flat NumPy buffers. Only needs numpy, no bpy and no
+package relative imports, so threads and worker processes can use it too.
+Axes are kept as they are in the file, like the OBJ operators do with
+forward Y and up Z.
+"""
+
+import functools
+import json
+import numpy
+import os
+import sys
+from collections import namedtuple
+
+# positions: (vertices, 3) float32, loops: vertex index per face corner,
+# loop_starts: first corner per face, uvs: (loops, 2) float32 or None
+MeshBuffers = namedtuple(
+    "MeshBuffers", ("positions", "loops", "loop_starts", "uvs"),
+    defaults=(None,))
+
+
+def malformed(reader):
+    """ Whatever a reader trips over in a broken or cut off file is raised
+    as ValueError, like the problems it checks for itself """
+    @functools.wraps(reader)
+    def read(path):
+        try:
+            return reader(path)
+        except (IndexError, KeyError, StopIteration, TypeError) as e:
+            raise ValueError(
+                f"{path}: malformed file ({type(e).__name__}: {e})") from e
+    return read
+
+
+def face_starts(sizes):
+    """ First corner of every face from the corner count of every face """
+    starts = numpy.zeros(len(sizes), dtype=numpy.int32)
+    numpy.cumsum(sizes[:-1], out=starts[1:])
+    return starts
+
+
+def floats(lines, width):
+    """ First width numbers of every line as a (lines, width) array """
+    if not lines:
+        return numpy.zeros((0, width), dtype=numpy.float32)
+    values = numpy.array(b" ".join(lines).split())
+    columns = len(lines[0].split())
+    if columns >= width and len(values) == columns * len(lines):
+        return values.astype(numpy.float32).reshape(-1, columns)[:, :width]
+    # Ragged rows (e.g. only some vertices have colors)
+    return numpy.array(
+        [line.split()[:width] for line in lines]).astype(numpy.float32)
+
+
+def indices(tokens, count):
+    """ OBJ indices start at one, negative ones count back from the end """
+    values = numpy.array(tokens).astype(numpy.int64)
+    return numpy.where(values < 0, values + count, values - 1).astype(numpy.int32)
+
+
+@malformed
+def read_obj(path):
+    """ Positions, faces and (when every corner has one) UVs of an OBJ file,
+    objects and groups merged into one mesh; normals, materials, smoothing
+    and loose edges are left out """
+    with open(path, 'rb') as obj_file:
+        lines = obj_file.read().split(b"\n")
+    positions = floats([line[2:] for line in lines if line.startswith(b"v ")], 3)
+    coordinates = [line[3:] for line in lines if line.startswith(b"vt ")]
+    faces = [line.split()[1:] for line in lines if line.startswith(b"f ")]
+    sizes = numpy.fromiter(map(len, faces), dtype=numpy.int32, count=len(faces))
+    corners = [corner.split(b"/") for face in faces for corner in face]
+    if not corners:
+        return MeshBuffers(
+            positions, numpy.zeros(0, numpy.int32), face_starts(sizes))
+    loops = indices([corner[0] for corner in corners], len(positions))
+    if loops.min() < 0 or loops.max() >= len(positions):
+        raise ValueError(f"{path}: face uses a vertex that doesn't exist")
+    uvs = None
+    if coordinates and all(len(corner) > 1 and corner[1] for corner in corners):
+        table = floats(coordinates, 2)
+        uvs = table[indices([corner[1] for corner in corners], len(table))]
+    return MeshBuffers(positions, loops, face_starts(sizes), uvs)
+
+
+def has_faces(buffers):
+    """ Whether there are faces and all of them have at least 3 corners, an
+    empty or cut off file can parse without errors but fails this """
+    if not len(buffers.loop_starts):
+        return False
+    sizes = numpy.diff(buffers.loop_starts, append=len(buffers.loops))
+    return bool((sizes >= 3).all())
+
+
+# PLY scalar types as numpy type codes, the byte order is added per file
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+    }
+PLY_FORMATS = {"binary_little_endian": "<", "binary_big_endian": ">", "ascii": None}
+
+
+def ply_type(ply_file, name):
+    if name not in PLY_TYPES:
+        raise ValueError(f"{ply_file.name}: unsupported property type {name}")
+    return PLY_TYPES[name]
+
+
+def ply_header(ply_file):
+    """ (byte order or None for ascii, [(element, count, properties)]) where
+    properties are (name, type) or (name, (count type, item type)) """
+    if ply_file.readline().strip() != b"ply":
+        raise ValueError(f"{ply_file.name}: not a PLY file")
+    order = None
+    elements = []
+    for line in ply_file:
+        words = line.decode("ascii", errors="replace").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "end_header":
+            return order, elements
+        if words[0] == "format":
+            if words[1] not in PLY_FORMATS:
+                raise ValueError(f"{ply_file.name}: unknown format {words[1]}")
+            order = PLY_FORMATS[words[1]]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property" and words[1] == "list":
+            elements[-1][2].append((
+                words[4], (ply_type(ply_file, words[2]), ply_type(ply_file, words[3]))))
+        elif words[0] == "property":
+            elements[-1][2].append((words[2], ply_type(ply_file, words[1])))
+    raise ValueError(f"{ply_file.name}: header never ends")
+
+
+def ply_faces(counts, indices):
+    """ Faces from per face corner counts and their concatenated corners """
+    counts = numpy.asarray(counts, dtype=numpy.int32)
+    return numpy.asarray(indices, dtype=numpy.int32), face_starts(counts)
+
+
+def read_ascii_faces(path, rows, column):
+    """ Faces from the rows of an ascii face element whose corner list
+    starts at column, anything after the corners is left out """
+    counts, corners = [], []
+    for row in rows:
+        size = int(row[column])
+        face = row[column + 1:column + 1 + size]
+        if len(face) != size:
+            raise ValueError(f"{path}: face has fewer corners than its count")
+        counts.append(size)
+        corners.extend(int(value) for value in face)
+    return ply_faces(counts, corners)
+
+
+def read_binary_faces(data, offset, order, count, count_type, item_type):
+    """ Faces are fixed size records when every face has as many corners as
+    the first one, which is by far the usual case; returns the faces and
+    the offset past them """
+    count_type = numpy.dtype(order + count_type)
+    item_type = numpy.dtype(order + item_type)
+    if not count:
+        return ply_faces([], []), offset
+    size = int(numpy.frombuffer(data, count_type, 1, offset)[0])
+    record = numpy.dtype([("count", count_type), ("corners", item_type, (size,))])
+    if len(data) - offset >= record.itemsize * count:
+        records = numpy.frombuffer(data, record, count, offset)
+        if (records["count"] == size).all():
+            return (
+                ply_faces(numpy.full(count, size), records["corners"].ravel()),
+                offset + record.itemsize * count)
+    counts, corners = [], []
+    for _ in range(count):
+        size = int(numpy.frombuffer(data, count_type, 1, offset)[0])
+        offset += count_type.itemsize
+        corners.append(numpy.frombuffer(data, item_type, size, offset))
+        offset += item_type.itemsize * size
+        counts.append(size)
+    return ply_faces(counts, numpy.concatenate(corners)), offset
+
+
+@malformed
+def read_ply(path):
+    """ Vertex positions and faces of an ascii or binary PLY file """
+    positions = numpy.zeros((0, 3), dtype=numpy.float32)
+    loops, loop_starts = ply_faces([], [])
+    with open(path, 'rb') as ply_file:
+        order, elements = ply_header(ply_file)
+        data = ply_file.read()
+    lines = iter(data.split(b"\n")) if order is None else None
+    offset = 0
+    for name, count, properties in elements:
+        lists = [prop for prop in properties if isinstance(prop[1], tuple)]
+        if lines:
+            rows = [next(lines).split() for _ in range(count)]
+            if name == "vertex":
+                columns = [prop[0] for prop in properties]
+                table = numpy.array(rows).astype(numpy.float32).reshape(count, -1)
+                positions = table[:, [columns.index(axis) for axis in "xyz"]]
+            elif name == "face" and lists:
+                loops, loop_starts = read_ascii_faces(
+                    path, rows, properties.index(lists[0]))
+            continue
+        if lists and (name != "face" or len(properties) != 1):
+            raise ValueError(f"{path}: unsupported list property in {name}")
+        if lists:
+            (loops, loop_starts), offset = read_binary_faces(
+                data, offset, order, count, *lists[0][1])
+            continue
+        record = numpy.dtype([(prop, order + kind) for prop, kind in properties])
+        table = numpy.frombuffer(data, record, count, offset)
+        offset += record.itemsize * count
+        if name == "vertex":
+            positions = numpy.stack(
+                [table[axis] for axis in "xyz"], axis=1).astype(numpy.float32)
+    if len(loops) and (loops.min() < 0 or loops.max() >= len(positions)):
+        raise ValueError(f"{path}: face uses a vertex that doesn't exist")
+    return MeshBuffers(positions, loops, loop_starts)
+
+
+def weld(corners):
+    """ STL stores three positions per triangle; share equal ones, keeping
+    the order they first show up in so sequences keep their topology """
+    positions, first, inverse = numpy.unique(
+        corners, axis=0, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty_like(order)
+    remap[order] = numpy.arange(len(order))
+    loops = remap[inverse.ravel()].astype(numpy.int32)
+    return MeshBuffers(
+        positions[order].astype(numpy.float32), loops,
+        numpy.arange(0, len(loops), 3, dtype=numpy.int32))
+
+
+@malformed
+def read_stl(path):
+    """ Triangles of an ascii or binary STL file, with shared vertices """
+    with open(path, 'rb') as stl_file:
+        data = stl_file.read()
+    if len(data) >= 84:
+        count = int(numpy.frombuffer(data, "<u4", 1, 80)[0])
+        if len(data) == 84 + 50 * count:
+            record = numpy.dtype([
+                ("normal", "<f4", (3,)), ("corners", "<f4", (3, 3)),
+                ("attribute", "<u2")])
+            triangles = numpy.frombuffer(data, record, count, 84)
+            return weld(triangles["corners"].reshape(-1, 3))
+    vertices = [
+        line.split()[1:4] for line in data.split(b"\n")
+        if line.strip().startswith(b"vertex")]
+    if not data.lstrip().startswith(b"solid") or len(vertices) % 3:
+        raise ValueError(f"{path}: not an STL file")
+    return weld(numpy.array(vertices).astype(numpy.float32).reshape(-1, 3))
+
+
+READERS = {".obj": read_obj, ".ply": read_ply, ".stl": read_stl}
+
+
+def read_mesh(path):
+    """ Parse any supported file by its extension """
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if not reader:
+        raise ValueError(f"{path}: unsupported file type")
+    return reader(path)
+
+
+def write_obj(path, buffers):
+    """ Positions, faces and UVs (one per corner) as an OBJ file """
+    with open(path, 'w') as obj_file:
+        numpy.savetxt(obj_file, buffers.positions, fmt="v %.6f %.6f %.6f")
+        if not len(buffers.loop_starts):
+            return
+        corners = (buffers.loops + 1).astype(str)
+        if buffers.uvs is not None:
+            numpy.savetxt(obj_file, buffers.uvs, fmt="vt %.6f %.6f")
+            uv_indices = numpy.arange(1, len(buffers.loops) + 1).astype(str)
+            corners = numpy.char.add(numpy.char.add(corners, "/"), uv_indices)
+        obj_file.write("".join(
+            f"f {' '.join(face)}\n"
+            for face in numpy.split(corners, buffers.loop_starts[1:])))
+
+# Vertex caches (see point_cache)
+
+
+def write_mdd(path, positions, times):
+    """ positions: (frames, vertices, 3), times: seconds per frame """
+    frames, count = positions.shape[:2]
+    with open(path, 'wb') as cache_file:
+        cache_file.write(numpy.array((frames, count), dtype=">i4").tobytes())
+        cache_file.write(numpy.asarray(times, dtype=">f4").tobytes())
+        cache_file.write(positions.astype(">f4").tobytes())
+
+
+def write_pc2(path, positions, start, rate=1.0):
+    """ positions: (frames, vertices, 3), sampled every rate frames from
+    start """
+    frames, count = positions.shape[:2]
+    with open(path, 'wb') as cache_file:
+        cache_file.write(b"POINTCACHE2\0")
+        cache_file.write(numpy.array((1, count), dtype="<i4").tobytes())
+        cache_file.write(numpy.array((start, rate), dtype="<f4").tobytes())
+        cache_file.write(numpy.array(frames, dtype="<i4").tobytes())
+        cache_file.write(positions.astype("<f4", copy=False).tobytes())
+
+# Chunks: many meshes packed into one .npz for a worker process
+
+
+def save_chunk(path, items):
+    """ Pack [(output path, MeshBuffers)] into one .npz """
+    paths, meshes = zip(*items)
+    counts = numpy.array([
+        (len(mesh.positions), len(mesh.loops), len(mesh.loop_starts),
+         mesh.uvs is not None) for mesh in meshes], dtype=numpy.int64)
+    uvs = [mesh.uvs for mesh in meshes if mesh.uvs is not None]
+    numpy.savez(
+        path, paths=numpy.array(paths), counts=counts,
+        positions=numpy.concatenate([mesh.positions for mesh in meshes]),
+        loops=numpy.concatenate([mesh.loops for mesh in meshes]),
+        loop_starts=numpy.concatenate([mesh.loop_starts for mesh in meshes]),
+        uvs=numpy.concatenate(uvs) if uvs else numpy.zeros((0, 2), numpy.float32))
+
+
+def load_chunk(path):
+    """ Yield (output path, MeshBuffers) from a chunk written by save_chunk """
+    with numpy.load(path) as chunk:
+        counts = chunk["counts"]
+        ends = numpy.cumsum(counts, axis=0)
+        starts = ends - counts
+        uv_ends = numpy.cumsum(counts[:, 1] * counts[:, 3])
+        for item, output in enumerate(chunk["paths"]):
+            (vertex, loop, face, _), (vertex_end, loop_end, face_end, _) = (
+                starts[item], ends[item])
+            uvs = None
+            if counts[item, 3]:
+                uvs = chunk["uvs"][uv_ends[item] - counts[item, 1]:uv_ends[item]]
+            yield str(output), MeshBuffers(
+                chunk["positions"][vertex:vertex_end],
+                chunk["loops"][loop:loop_end],
+                chunk["loop_starts"][face:face_end],
+                uvs)
+
+
+def write_chunk(path):
+    for output, buffers in load_chunk(path):
+        write_obj(output, buffers)
+
+# Drawing cache: a JSON header holding the frame table and the layout of
+# every drawing, followed by the arrays themselves, each aligned so it can
+# be used in place from a memory map
+
+CACHE_MAGIC = b"STPMODRW"
+CACHE_FORMAT = 1
+CACHE_ALIGN = 64
+CACHE_EXTENSION = ".drawings"
+
+
+def aligned(offset):
+    return -(-offset // CACHE_ALIGN) * CACHE_ALIGN
+
+
+def write_cache(path, frames, drawings):
+    """ frames: {frame: drawing index}, drawings: {index: (info, arrays)}
+    where info is anything JSON and arrays is {name: array} """
+    layout = {}
+    blobs = []
+    offset = 0
+    for index, (info, arrays) in drawings.items():
+        entries = {}
+        for name, array in arrays.items():
+            array = numpy.ascontiguousarray(
+                array, dtype=array.dtype.newbyteorder("<"))
+            offset = aligned(offset)
+            entries[name] = (offset, array.dtype.str, array.shape)
+            if array.nbytes:
+                blobs.append((offset, array))
+            offset += array.nbytes
+        layout[str(index)] = {"info": info, "arrays": entries}
+    header = json.dumps({
+        "format": CACHE_FORMAT,
+        "frames": sorted(frames.items()),
+        "drawings": layout,
+        }, separators=(",", ":")).encode()
+    start = aligned(len(CACHE_MAGIC) + 8 + len(header))
+    with open(path, 'wb') as cache_file:
+        cache_file.write(CACHE_MAGIC)
+        cache_file.write(numpy.array(len(header), dtype="<u8").tobytes())
+        cache_file.write(header)
+        for blob_offset, array in blobs:
+            cache_file.seek(start + blob_offset)
+            cache_file.write(memoryview(array).cast("B"))
+        cache_file.truncate(start + offset)
+
+
+class DrawingCache():
+    """ Memory mapped drawing cache; arrays are read only views into the
+    file, so loading one drawing only touches the pages it lives on """
+
+    def __init__(self, path):
+        with open(path, 'rb') as cache_file:
+            magic = cache_file.read(len(CACHE_MAGIC))
+            if magic != CACHE_MAGIC:
+                raise ValueError(f"{path}: not a drawing cache")
+            length = int(numpy.frombuffer(cache_file.read(8), dtype="<u8")[0])
+            header = json.loads(cache_file.read(length))
+        if header["format"] > CACHE_FORMAT:
+            raise ValueError(f"{path}: written by a newer version")
+        self.path = path
+        self.start = aligned(len(CACHE_MAGIC) + 8 + length)
+        self.frames = [(int(frame), index) for frame, index in header["frames"]]
+        self.layout = {
+            int(index): drawing for index, drawing in header["drawings"].items()}
+        self.map = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+
+    def __iter__(self):
+        return iter(self.layout)
+
+    def __contains__(self, index):
+        return index in self.layout
+
+    def index_at(self, frame):
+        """ Cached drawing shown at frame (the last frame entry up to it) """
+        index = None
+        for cached_frame, cached_index in self.frames:
+            if cached_frame > frame:
+                break
+            index = cached_index
+        return index
+
+    def info(self, index):
+        return self.layout[index]["info"]
+
+    def arrays(self, index):
+        """ {name: array} of one drawing, without copying """
+        arrays = {}
+        for name, (offset, dtype, shape) in self.layout[index]["arrays"].items():
+            dtype = numpy.dtype(dtype)
+            start = self.start + offset
+            size = int(numpy.prod(shape)) * dtype.itemsize
+            if start + size > len(self.map):
+                raise ValueError(f"{self.path}: cut off in {name}")
+            arrays[name] = self.map[start:start + size].view(dtype).reshape(shape)
+        return arrays
+
+
+if __name__ == "__main__":
+    # Worker process: python mesh_io.py chunk.npz [chunk.npz ...]
+    for chunk_path in sys.argv[1:]:
+        write_chunk(chunk_path)
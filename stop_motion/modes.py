@@ -37,7 +37,7 @@ else:
     from . import modifier_data
 
 import bpy
-from .modifier_data import Modifier, StopMotionOperator
+from .modifier_data import Modifier, StopMotionOperator, is_stop_motion
 
 
 def set_object(mode):
@@ -70,26 +70,38 @@ class OBJECT_OT_stop_motion_mode(StopMotionOperator):
     def execute(self, context):
 
         ob = context.object
-        modifier = Modifier(ob)
-        if modifier:
-            collection = modifier.collection
-            index = modifier.index
+        if self.toggle and self.mode == ob.mode:
+            self.mode = 'OBJECT'
+        objects = [ob]
+        if 'EDIT' in (self.mode, ob.mode):
+            # Only edit mode takes the selection along, sculpt and paint
+            # modes leave the other objects where they are
+            objects += [
+                o for o in context.selected_objects
+                if o is not ob and is_stop_motion(o) and o.mode == ob.mode]
+        for obj in objects:
+            modifier = Modifier(obj)
 
             # put the correct object_data in
-            sources = sorted([o for o in collection.objects], key=lambda o:o.name)
-            ob.data = sources[index].data
-
-            if self.toggle and self.mode == ob.mode:
-                self.mode = 'OBJECT'
+            drawing = modifier.get_object()
+            if self.mode == 'OBJECT':
+                obj.data = drawing.data
+            else:
+                obj.data = modifier_data.unshare(drawing)
+            update_handler.forget(obj)
 
             if self.mode == 'OBJECT':
-                update_handler.remove()
                 modifier.reveal_viewport()
             else:
-                update_handler.add()
                 modifier.hide_viewport()
 
-        return bpy.ops.object.mode_set(mode=self.mode, toggle=self.toggle)
+        result = bpy.ops.object.mode_set(mode=self.mode, toggle=self.toggle)
+        if self.mode == 'OBJECT':
+            update_handler.remove()
+        else:
+            update_handler.track(objects)
+            update_handler.add()
+        return result
 
 
 class OBJECT_OT_stop_motion_updater_toggle(bpy.types.Operator):
@@ -101,9 +113,8 @@ class OBJECT_OT_stop_motion_updater_toggle(bpy.types.Operator):
     @classmethod
     def poll(cls, context):
         obj = context.object
-        modifier = Modifier(obj)
         running = update_handler.is_running()
-        if not modifier:
+        if not is_stop_motion(obj):
             return running
         object_mode = obj.mode == 'OBJECT'
         if object_mode:
@@ -117,6 +128,7 @@ class OBJECT_OT_stop_motion_updater_toggle(bpy.types.Operator):
             if modifier.modifier:
                 modifier.reveal_viewport()
         else:
+            update_handler.track({context.object, *context.selected_objects})
             update_handler.add()
             if modifier.modifier:
                 modifier.hide_viewport()
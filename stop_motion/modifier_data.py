@@ -24,13 +24,281 @@ else:
     from . import version
 
 import bpy
+from bisect import bisect_left, bisect_right
+from bpy.app.handlers import persistent
 
 MODNAME = "StopMotion"
 COLNAME = "StopMotion Sources"
 
+# Drawing lookup modes: node group name
+LOOKUPS = {
+    'COLLECTION': "MeshKey",
+    'OBJECT': "MeshKeyObject",
+    }
+LOOKUP_ITEMS = [
+    (
+        'COLLECTION', "Collection",
+        "Pick the drawing out of the whole source collection, "
+        "plays back without the add-on but slows down with many drawings"),
+    (
+        'OBJECT', "Object",
+        "Point the modifier at the current drawing only, constant time "
+        "per frame but needs the add-on for playback and render"),
+    ]
+# In Object lookup the collection lives on the object, not the modifier, so
+# that the depsgraph doesn't pull in every drawing
+COLLECTION_PROP = f"{version.NAME}_collection"
+# Drawings per chunk on a source collection whose drawings are offloaded to
+# chunk libraries (see library_storage), only some of them are linked
+CHUNK_SIZE_PROP = f"{version.NAME}_chunk_size"
+# One past the highest index written to a chunk, released drawings keep
+# theirs so new ones must not reuse them
+INDEX_END_PROP = f"{version.NAME}_index_end"
+
+# Keyframe interpolation enum value, for foreach_set
+CONSTANT = 0
+# Deduplicated meshes are flagged so they get copied before being edited
+SHARED_PROP = f"{version.NAME}_shared"
+# Packed drawings share a base mesh holding their positions as attributes
+PACKED_PROP = f"{version.NAME}_packed"
+# Every drawing knows its index, names are only labels
+INDEX_PROP = f"{version.NAME}_index"
+PACKED_PREFIX = f"{version.NAME}_P_"
+UNPACK_MODIFIER = f"{version.NAME}_Unpack"
+
 # Data  Helpers
 
 
+# {index: drawing} per source collection pointer: (object count, mapping)
+drawing_maps = {}
+
+
+def invalidate_drawing_maps():
+    drawing_maps.clear()
+
+
+def tag_drawing(drawing, index):
+    drawing[INDEX_PROP] = index
+
+
+def migrate_drawings(collection):
+    """ Tag drawings of older files with the index their name implies,
+    return how many were tagged """
+    tagged = 0
+    for drawing in collection.objects:
+        if INDEX_PROP in drawing:
+            continue
+        index = version.frame_index(drawing.name)
+        if index is not None:
+            tag_drawing(drawing, index)
+            tagged += 1
+    if tagged:
+        drawing_maps.pop(collection.as_pointer(), None)
+    return tagged
+
+
+def drawing_map(collection):
+    """ Memoized {index: drawing} of a source collection """
+    key = collection.as_pointer()
+    objects = collection.objects
+    cached = drawing_maps.get(key)
+    if cached and cached[0] == len(objects):
+        return cached[1]
+    mapping = {}
+    for drawing in objects:
+        index = drawing.get(INDEX_PROP)
+        if index is None:
+            # Not migrated yet, we may not be allowed to write here
+            index = version.frame_index(drawing.name)
+        if index is not None:
+            mapping[index] = drawing
+    drawing_maps[key] = (len(objects), mapping)
+    return mapping
+
+
+def find_drawing(collection, index):
+    """ Drawing object for index, or None, in constant time """
+    drawing = drawing_map(collection).get(index)
+    try:
+        if drawing is not None and drawing.get(INDEX_PROP, index) == index:
+            return drawing
+    except ReferenceError:
+        pass
+    # Removed or renumbered behind our back
+    drawing_maps.pop(collection.as_pointer(), None)
+    return drawing_map(collection).get(index)
+
+
+
+def is_offloaded(collection):
+    """ Whether some drawings of the collection may be in released chunks
+    rather than in it """
+    return bool(collection) and CHUNK_SIZE_PROP in collection
+
+
+def localize(drawing):
+    """ Make a drawing linked from an external library chunk editable, it
+    gets written back to its chunk on the next save """
+    if drawing.library:
+        drawing.make_local()
+    if drawing.data.library:
+        drawing.data = drawing.data.make_local()
+
+
+def unpacked_copy(base):
+    """ Copy of a packed base mesh without the packed positions """
+    mesh = base.copy()
+    packed = [a.name for a in mesh.attributes if a.name.startswith(PACKED_PREFIX)]
+    for name in packed:
+        mesh.attributes.remove(mesh.attributes[name])
+    return mesh
+
+
+def unpacked_mesh(drawing, template=None):
+    """ New mesh of what a packed drawing shows, leaving it packed """
+    base = drawing.data
+    mesh = template.copy() if template else unpacked_copy(base)
+    mesh.name = drawing.name
+    positions = [0.0] * (3 * len(mesh.vertices))
+    base.attributes[drawing[PACKED_PROP]].data.foreach_get("vector", positions)
+    mesh.vertices.foreach_set("co", positions)
+    mesh.update()
+    return mesh
+
+
+def unpack(drawing, template=None):
+    """ Give a packed drawing its own mesh again, return its mesh; template
+    is an unpacked_copy of its base to copy from when unpacking many """
+    attribute = drawing.get(PACKED_PROP)
+    if not attribute:
+        return drawing.data
+    localize(drawing)
+    base = drawing.data
+    mesh = unpacked_mesh(drawing, template)
+    base.attributes.remove(base.attributes[attribute])
+    modifier = drawing.modifiers.get(UNPACK_MODIFIER)
+    if modifier:
+        drawing.modifiers.remove(modifier)
+    del drawing[PACKED_PROP]
+    drawing.data = mesh
+    return mesh
+
+
+def unshare(drawing):
+    """ Give a drawing its own mesh if deduplication or packing shares it,
+    return it """
+    localize(drawing)
+    mesh = unpack(drawing)
+    if not mesh.get(SHARED_PROP):
+        return mesh
+    copy = mesh.copy()
+    del copy[SHARED_PROP]
+    drawing.data = copy
+    return copy
+
+
+class Timeline():
+    """ Sorted, bisectable snapshot of the Instance Index keyframes """
+
+    tolerance = .001
+
+    def __init__(self, action, fcurve_index, fcurve):
+        self.action = action.as_pointer()
+        self.fcurve_index = fcurve_index
+        points = fcurve.keyframe_points
+        self.count = len(points)
+        co = [0.0] * (2 * self.count)
+        points.foreach_get("co", co)
+        # Keep the keyframe point position so we can get back to the key
+        keys = sorted(
+            (frame, position, value) for position, (frame, value)
+            in enumerate(zip(co[::2], co[1::2])))
+        self.frames = [key[0] for key in keys]
+        self.positions = [key[1] for key in keys]
+        self.indices = [int(round(key[2])) for key in keys]
+
+    def __len__(self):
+        return self.count
+
+    def index_at(self, frame):
+        """ Drawing index shown at frame (constant interpolation) """
+        if not self.frames:
+            return None
+        key = bisect_right(self.frames, frame + self.tolerance) - 1
+        return self.indices[max(key, 0)]
+
+    def key_at(self, frame):
+        """ Keyframe point position of a key on frame, or None """
+        key = bisect_left(self.frames, frame - self.tolerance)
+        if key < self.count and self.frames[key] <= frame + self.tolerance:
+            return self.positions[key]
+        return None
+
+    def next_key(self, frame):
+        """ Frame of the first key after frame, or None """
+        key = bisect_right(self.frames, frame + self.tolerance)
+        return self.frames[key] if key < self.count else None
+
+    def previous_key(self, frame):
+        """ Frame of the last key before frame, or None """
+        key = bisect_left(self.frames, frame - self.tolerance) - 1
+        return self.frames[key] if key >= 0 else None
+
+    def drawings(self):
+        """ Set of drawing indices referenced by any key """
+        return set(self.indices)
+
+
+# Timelines per object pointer, validated on access and dropped on updates
+timelines = {}
+msgbus_owner = object()
+
+
+def invalidate_timelines(action=None):
+    """ Forget cached timelines, for one action or all of them """
+    if action is None:
+        timelines.clear()
+        return
+    pointer = action.as_pointer()
+    for key in [k for k, t in timelines.items() if t.action == pointer]:
+        del timelines[key]
+
+
+# Group input identifiers per node group pointer: (revision, {name: id})
+socket_identifiers = {}
+# Bumped whenever the depsgraph reports a node group update
+interface_revisions = {}
+
+
+def get_socket_identifiers(node_group):
+    """ Memoized {input name: identifier} of a MeshKey node group """
+    key = node_group.as_pointer()
+    revision = interface_revisions.get(key, 0)
+    cached = socket_identifiers.get(key)
+    if cached and cached[0] == revision:
+        return cached[1]
+    identifiers = {
+        item.name: item.identifier for item in node_group.interface.items_tree
+        if item.item_type == 'SOCKET' and item.in_out == 'INPUT'}
+    socket_identifiers[key] = (revision, identifiers)
+    return identifiers
+
+
+def invalidate_identifiers(node_group=None):
+    """ Forget memoized identifiers, for one node group or all of them """
+    if node_group is None:
+        socket_identifiers.clear()
+        interface_revisions.clear()
+        return
+    key = node_group.as_pointer()
+    interface_revisions[key] = interface_revisions.get(key, 0) + 1
+
+
+def is_stop_motion(obj):
+    """ Cheapest check for polls: no node group or interface access """
+    return bool(obj and obj.modifiers.get(MODNAME))
+
+
 class Modifier():
     """ Convenience Stop Motion Modifier Access Class """
 
@@ -43,9 +311,11 @@ class Modifier():
         else:
             self.modifier = obj.modifiers.get(MODNAME)
         if self.modifier:
+            identifiers = get_socket_identifiers(self.modifier.node_group)
             # Hopefully we won't use these outside the class
-            self.__index__ = self.__get_input_label__("Instance Index")
-            self.__collection__ = self.__get_input_label__("Collection")
+            self.__index__ = identifiers.get("Instance Index")
+            self.__collection__ = identifiers.get("Collection")
+            self.__drawing__ = identifiers.get("Object")
 
             # Handy for e.g. < row.prop(m.modifier, m.index_prop) >
             self.index_prop = f'["{self.__index__}"]'
@@ -55,9 +325,6 @@ class Modifier():
         """ We can use e.g. < is Modifier(obj) > in poll functions """
         return True if self.modifier else False
 
-    def __get_input_label__(self, input):
-        return self.modifier.node_group.interface.items_tree[input].identifier
-
     @property
     def index(self):
        return self.modifier[self.__index__]
@@ -66,63 +333,236 @@ class Modifier():
     def index(self, value):
         self.modifier[self.__index__] = value
 
+    @property
+    def lookup(self):
+        """ Drawing lookup mode, see LOOKUPS """
+        return 'OBJECT' if self.__drawing__ else 'COLLECTION'
+
     @property
     def collection(self):
         if not self.modifier:
             return None
+        if self.lookup == 'OBJECT':
+            return self.obj.get(COLLECTION_PROP)
         return self.modifier[self.__collection__]
 
     @collection.setter
     def collection(self, value):
         if not self.modifier:
             return
+        if self.lookup == 'OBJECT':
+            self.obj[COLLECTION_PROP] = value
+            return
         self.modifier[self.__collection__] = value
 
+    @property
+    def drawing(self):
+        """ Object currently fed to an Object lookup modifier """
+        if not self.__drawing__:
+            return None
+        return self.modifier[self.__drawing__]
+
+    @drawing.setter
+    def drawing(self, value):
+        if not self.__drawing__:
+            return
+        self.modifier[self.__drawing__] = value
+
+    def sync_drawing(self, index=None):
+        """ Point an Object lookup modifier at the drawing for index """
+        if self.lookup != 'OBJECT':
+            return
+        if index is None:
+            index = self.index
+        drawing = find_drawing(self.collection, index)
+        if self.drawing != drawing:
+            self.drawing = drawing
+
+    @property
+    def fcurve_path(self):
+        return f'modifiers["{self.modifier.name}"]{self.index_prop}'
+
+    def get_action(self):
+        animation_data = self.modifier.id_data.animation_data
+        return animation_data.action if animation_data else None
+
+    def __cached_fcurve__(self, action):
+        """ (timeline, fcurve) from the cache without walking the action """
+        timeline = timelines.get(self.obj.as_pointer())
+        if not timeline or timeline.action != action.as_pointer():
+            return None, None
+        fcurves = action.fcurves
+        if timeline.fcurve_index >= len(fcurves):
+            return timeline, None
+        fcurve = fcurves[timeline.fcurve_index]
+        if fcurve.data_path != self.fcurve_path:
+            return timeline, None
+        return timeline, fcurve
+
     def get_fcurve(self):
-        action = self.modifier.id_data.animation_data.action
+        action = self.get_action()
+        if not action:
+            return None
+        timeline, fcurve = self.__cached_fcurve__(action)
+        if not fcurve and self.timeline:
+            # Walked once and cached by the timeline
+            timeline, fcurve = self.__cached_fcurve__(action)
+        return fcurve
+
+    def find_fcurve(self, action):
+        """ Walk the action for the index fcurve: (position, fcurve) """
         fcurves = (
-            f for f in action.fcurves
-            if f.data_path == f'modifiers["{self.modifier.name}"]["{self.__index__}"]' and f.array_index == 0
+            (i, f) for i, f in enumerate(action.fcurves)
+            if f.data_path == self.fcurve_path and f.array_index == 0
             )
         for fcurve in fcurves:
             return fcurve
+        return None, None
+
+    @property
+    def timeline(self):
+        """ Cached Timeline of the index fcurve, rebuilt when stale """
+        action = self.get_action()
+        if not action:
+            return None
+        timeline, fcurve = self.__cached_fcurve__(action)
+        if fcurve and len(fcurve.keyframe_points) == timeline.count:
+            return timeline
+        fcurve_index, fcurve = self.find_fcurve(action)
+        key = self.obj.as_pointer()
+        if not fcurve:
+            timelines.pop(key, None)
+            return None
+        timeline = timelines[key] = Timeline(action, fcurve_index, fcurve)
+        return timeline
 
     def keyframe_index(self, context):
         """ Insert a Keyframe at the current frame on the index prop """
-
-        self.modifier.keyframe_insert(f'["{self.__index__}"]')
-
+        frame = context.scene.frame_current
+        fcurve = self.get_fcurve()
+        if fcurve:
+            keyframe = fcurve.keyframe_points.insert(frame, self.index)
+        else:
+            self.modifier.keyframe_insert(self.index_prop)
+            fcurve = self.get_fcurve()
+            if not fcurve:
+                return # TODO error if no keyframe inserted
+            keyframe = fcurve.keyframe_points[-1]
         # Now make sure it is constant
+        keyframe.interpolation = 'CONSTANT'
+        timelines.pop(self.obj.as_pointer(), None)
+
+    def keyframe_indices(self, keys):
+        """ Key many (frame, index) pairs in one go, replacing keys on the
+        same frames; every written key is constant """
+        keys = dict(keys)
+        if not keys:
+            return
         fcurve = self.get_fcurve()
         if not fcurve:
-            return # TODO error if no keyframe inserted
-        keyframes = (
-            k for k in fcurve.keyframe_points
-            if abs(k.co[0] - context.scene.frame_current) <= .001
-            )
-        for keyframe in keyframes:
-            keyframe.interpolation = 'CONSTANT'
+            frame, index = next(iter(keys.items()))
+            self.index = index
+            self.modifier.keyframe_insert(self.index_prop, frame=frame)
+            fcurve = self.get_fcurve()
+            if not fcurve:
+                raise RuntimeError(
+                    f"Couldn't key the drawing index of {self.obj.name}")
+        timeline = self.timeline
+        points = fcurve.keyframe_points
+        count = len(points)
+        co = [0.0] * (2 * count)
+        points.foreach_get("co", co)
+        interpolation = [0] * count
+        points.foreach_get("interpolation", interpolation)
+        added = 0
+        for frame, index in keys.items():
+            position = timeline.key_at(frame)
+            if position is None:
+                co.extend((frame, index))
+                interpolation.append(CONSTANT)
+                added += 1
+            else:
+                co[2 * position + 1] = index
+                interpolation[position] = CONSTANT
+        points.add(added)
+        points.foreach_set("co", co)
+        points.foreach_set("interpolation", interpolation)
+        fcurve.update() # sorts the new keys in and fixes their handles
+        timelines.pop(self.obj.as_pointer(), None)
+
+    def index_at(self, frame):
+        """ Drawing index at frame according to the keys """
+        timeline = self.timeline
+        index = timeline.index_at(frame) if timeline else None
+        return self.index if index is None else index
 
     def future_keys(self, context):
-        fcurve = self.get_fcurve()
-        if not fcurve:
+        timeline = self.timeline
+        if not timeline:
             return False # Technically this should be an error
-        frame = context.scene.frame_current
-        for keyframe in (k.co[0] for k in fcurve.keyframe_points if k.co[0] > frame):
-            return True
-        return False
+        return timeline.next_key(context.scene.frame_current) is not None
+
+    def drawings_in_use(self):
+        """ Drawing indices referenced by the keys """
+        timeline = self.timeline
+        return timeline.drawings() if timeline else {self.index}
+
+    def name_digits(self, index=0):
+        """ Digits the drawing names need to sort in index order, counting
+        index as well as the existing drawings """
+        highest = max(index, max(drawing_map(self.collection), default=0))
+        return max(version.FRAME_DIGITS, len(str(highest)))
 
     def object_name(self, index=None):
         """Return properly indexed object frame name"""
         if index is None:
             index = self.index
-        # Might adjust formatting later to minimize collisions?
-        return version.frame_name(index, self.obj)
+        return version.frame_name(index, self.obj, self.name_digits(index))
+
+    def rename_drawings(self):
+        """ Pad every drawing name to the digits the highest index needs,
+        once a new index outgrows the old width """
+        if is_offloaded(self.collection):
+            return # Linked drawings can't be renamed, the Object lookup is used
+        digits = self.name_digits()
+        drawings = self.drawings()
+        # Two passes so new names never collide with old ones
+        for drawing in drawings.values():
+            drawing.name = f"{drawing.name}.rename"
+        for index, drawing in drawings.items():
+            drawing.name = version.frame_name(index, self.obj, digits)
 
     def get_object(self, index=None):
-        name = self.object_name(index)
+        if index is None:
+            index = self.index
+        drawing = find_drawing(self.collection, index)
+        if drawing is None:
+            raise KeyError(f"{self.obj.name} has no drawing {index}")
+        return drawing
+
+    def drawings(self):
+        """ {index: drawing object} for the whole source collection """
+        return dict(drawing_map(self.collection))
+
+    def next_index(self):
+        """ Index for a new drawing, past any existing one, including the
+        ones in released chunks """
         collection = self.collection
-        return collection.objects[name]
+        return max(
+            max(drawing_map(collection), default=-1) + 1,
+            collection.get(INDEX_END_PROP, 0))
+
+    def index_fcurves(self):
+        """ Every fcurve animating the index: active action and NLA strips """
+        animation_data = self.obj.animation_data
+        if not animation_data:
+            return []
+        actions = {animation_data.action} | {
+            strip.action for track in animation_data.nla_tracks
+            for strip in track.strips}
+        actions.discard(None)
+        path = self.fcurve_path
+        return [f for a in actions for f in a.fcurves if f.data_path == path]
 
     def hide_viewport(self):
         self.modifier.show_viewport = False
@@ -141,8 +581,72 @@ class StopMotionOperator(bpy.types.Operator):
         if not ob:
             cls.poll_message_set("No Active Object")
             return False
-        if not Modifier(ob):
+        if not is_stop_motion(ob):
             cls.poll_message_set(f"{ob.name} Not Initialized")
             return False
         return True
 
+# Cache invalidation
+
+
+@persistent
+def cache_depsgraph_update(scene, depsgraph):
+    """ Keys moved, values edited, sockets added etc. show up as updates """
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Action):
+            invalidate_timelines(update.id.original)
+        elif isinstance(update.id, bpy.types.NodeTree):
+            invalidate_identifiers(update.id.original)
+
+
+@persistent
+def cache_reset(*args):
+    """ Undo and file loads leave nothing we can trust """
+    invalidate_timelines()
+    invalidate_identifiers()
+    invalidate_drawing_maps()
+    subscribe()
+
+
+@persistent
+def migrate_file(*args):
+    """ Older files looked drawings up by (sorted) name """
+    for collection in bpy.data.collections:
+        if version.is_main(collection) and not collection.library:
+            migrate_drawings(collection)
+
+
+def timeline_action_changed(*args):
+    invalidate_timelines()
+
+
+def subscribe():
+    bpy.msgbus.clear_by_owner(msgbus_owner)
+    bpy.msgbus.subscribe_rna(
+        key=(bpy.types.AnimData, "action"), owner=msgbus_owner, args=(),
+        notify=timeline_action_changed)
+
+
+handlers = (
+    (bpy.app.handlers.depsgraph_update_post, cache_depsgraph_update),
+    (bpy.app.handlers.undo_post, cache_reset),
+    (bpy.app.handlers.redo_post, cache_reset),
+    (bpy.app.handlers.load_post, cache_reset),
+    (bpy.app.handlers.load_post, migrate_file),
+    )
+
+
+def register():
+    for handler_list, handler in handlers:
+        handler_list.append(handler)
+    subscribe()
+
+
+def unregister():
+    bpy.msgbus.clear_by_owner(msgbus_owner)
+    for handler_list, handler in handlers:
+        if handler in handler_list:
+            handler_list.remove(handler)
+    invalidate_timelines()
+    invalidate_identifiers()
+    invalidate_drawing_maps()
@@ -0,0 +1,108 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Node Group Library
+Every node group of the add-on, built once from the bundled templates into
+a .blend in the user data directory, then appended in one go wherever
+groups are missing. The file name carries a hash of the templates and the
+Blender version, so changing either builds a fresh library.
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(json_nodes)
+else:
+    from . import json_nodes
+
+import bpy
+import glob
+import hashlib
+import os
+
+# Templates of every node group, see json_nodes.Bundle
+BUNDLE = os.path.join(
+    os.path.dirname(__file__), f"node_groups{json_nodes.BUNDLE_EXTENSION}")
+PREFIX = "node_groups_"
+
+
+def read_group(name):
+    """ Get the named add-on node group, building it if needed """
+    return json_nodes.read_node(name, BUNDLE)
+
+
+def library_hash():
+    """ Changes with any template or with the Blender version """
+    templates = json_nodes.bundle(BUNDLE)
+    digest = hashlib.sha1(bpy.app.version_string.encode())
+    for name in templates:
+        digest.update(name.encode())
+        digest.update(templates.digest(name).encode())
+    return digest.hexdigest()[:16]
+
+
+def library_path():
+    directory = bpy.utils.user_resource(
+        'DATAFILES', path="stop_motion", create=True)
+    return os.path.join(directory, f"{PREFIX}{library_hash()}.blend")
+
+
+def build_library(path):
+    """ Build every group from its template in scratch data and write them
+    to path, replacing libraries of older templates or Blender versions;
+    groups of the open file (edited or older ones) never end up in it """
+    templates = json_nodes.bundle(BUNDLE)
+    temporary = f"{path}.tmp"
+    with bpy.data.temp_data() as data:
+        groups = set()
+        for name in templates:
+            node_group = json_nodes.Node_Tree(
+                name, tree_data=templates.tree_data(name), data=data).create(
+                tree_type=templates.tree_type(name))
+            node_group[json_nodes.HASH_PROP] = templates.digest(name)
+            groups.add(node_group)
+        data.libraries.write(temporary, groups, fake_user=True, compress=True)
+    os.replace(temporary, path)
+    for stale in glob.glob(os.path.join(os.path.dirname(path), f"{PREFIX}*.blend")):
+        if stale != path:
+            os.remove(stale)
+
+
+def ensure_groups(names=None):
+    """ Make sure the named groups (default all) are in the file, appending
+    the missing ones from the library in a single load """
+    missing = [
+        name for name in json_nodes.bundle(BUNDLE)
+        if (names is None or name in names) and name not in bpy.data.node_groups]
+    if not missing:
+        return
+    path = library_path()
+    if not os.path.exists(path):
+        try:
+            build_library(path)
+        except (OSError, RuntimeError) as e:
+            # read_group still builds whatever is missing from templates
+            print(f"Warning: {e}: ", path)
+            return
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.node_groups = [
+            name for name in missing if name in data_from.node_groups]
+    for node_group in data_to.node_groups:
+        if node_group:
+            node_group.use_fake_user = False
@@ -17,28 +17,396 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 """
-Operators that thinly wrap Blender's wavefront obj Import/Export directly
-as Stop Motion targets. See https://www.srcxor.org/blog/3d-glitching/ to
-understand why this exists :)
+Operators that read and write wavefront obj files directly as Stop Motion
+targets. See https://www.srcxor.org/blog/3d-glitching/ to understand why
+this exists :)
 """
 
 if "bpy" in locals():
     import importlib
+    importlib.reload(animation)
+    importlib.reload(drawings)
+    importlib.reload(mesh_io)
     importlib.reload(modifier_data)
     importlib.reload(modes)
 else:
+    from . import animation
+    from . import drawings
+    from . import mesh_io
     from . import modifier_data
     from . import modes
 
 import bpy
+import glob
+import json
+import numpy
 import os
-from .modifier_data import Modifier, StopMotionOperator
+import re
+import subprocess
+import sys
+import tempfile
+from bpy.app.handlers import persistent
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .modifier_data import Modifier, StopMotionOperator, is_stop_motion
+
+# Seconds between checks of live linked OBJ files
+LIVE_INTERVAL = 0.5
+
+# Live linked object name: (obj file path, (mtime, size) last read,
+# (mtime, size) seen by the last poll)
+live_links = {}
 
 
 def path(context):
     return context.blend_data.filepath.replace(
         ".blend", f"_{context.object.name}_frame.obj")
 
+
+def same_topology(mesh, buffers):
+    """ Whether mesh has exactly the faces the buffers describe """
+    counts = (len(mesh.vertices), len(mesh.loops), len(mesh.polygons))
+    if counts != tuple(map(len, buffers[:3])):
+        return False
+    return (
+        numpy.array_equal(
+            drawings.read(mesh.loops, "vertex_index", numpy.int32, 1),
+            buffers.loops)
+        and numpy.array_equal(
+            drawings.read(mesh.polygons, "loop_start", numpy.int32, 1),
+            buffers.loop_starts))
+
+
+def set_positions(mesh, positions):
+    mesh.vertices.foreach_set(
+        "co", numpy.ascontiguousarray(positions, dtype=numpy.float32).ravel())
+    mesh.update()
+
+
+def mesh_from_buffers(name, buffers, template=None):
+    """ New mesh from parsed buffers; when the topology matches template it
+    is a copy of it with new positions, keeping UVs, materials and so on """
+    if template and same_topology(template, buffers):
+        mesh = template.copy()
+        mesh.name = name
+        if mesh.get(modifier_data.SHARED_PROP):
+            del mesh[modifier_data.SHARED_PROP]
+        set_positions(mesh, buffers.positions)
+        return mesh
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(buffers.positions))
+    mesh.vertices.foreach_set("co", buffers.positions.ravel())
+    mesh.loops.add(len(buffers.loops))
+    mesh.loops.foreach_set("vertex_index", buffers.loops)
+    mesh.polygons.add(len(buffers.loop_starts))
+    mesh.polygons.foreach_set("loop_start", buffers.loop_starts)
+    if buffers.uvs is not None:
+        uv_layer = mesh.uv_layers.new(name="UVMap")
+        uv_layer.data.foreach_set("uv", buffers.uvs.ravel())
+    if template:
+        for material in template.materials:
+            mesh.materials.append(material)
+    mesh.update(calc_edges=True)
+    return mesh
+
+def template_mesh(drawing):
+    """ (mesh to copy new drawings from, whether it is a temporary copy to
+    remove after); a packed drawing's base is copied, not unpacked """
+    if drawing.get(modifier_data.PACKED_PROP):
+        return modifier_data.unpacked_copy(drawing.data), True
+    return drawing.data, False
+
+
+def drawing_buffers(drawing, use_uvs=True):
+    """ MeshBuffers of a drawing, reading packed positions without
+    unpacking it """
+    mesh = drawing.data
+    attribute = drawing.get(modifier_data.PACKED_PROP)
+    if attribute:
+        positions = drawings.read(
+            mesh.attributes[attribute].data, "vector", numpy.float32, 3)
+    else:
+        positions = drawings.read(mesh.vertices, "co", numpy.float32, 3)
+    uvs = None
+    if use_uvs and mesh.uv_layers.active:
+        uvs = drawings.read(
+            mesh.uv_layers.active.data, "uv", numpy.float32, 2).reshape(-1, 2)
+    return mesh_io.MeshBuffers(
+        positions.reshape(-1, 3),
+        drawings.read(mesh.loops, "vertex_index", numpy.int32, 1),
+        drawings.read(mesh.polygons, "loop_start", numpy.int32, 1),
+        uvs)
+
+
+def sequence_frames(modifier, frame_range=None):
+    """ {frame: drawing index} of every key, or of every frame in range """
+    if frame_range:
+        start, end = frame_range
+        return {frame: modifier.index_at(frame) for frame in range(start, end + 1)}
+    timeline = modifier.timeline
+    if not timeline:
+        return {}
+    return {
+        int(round(frame)): index
+        for frame, index in zip(timeline.frames, timeline.indices)}
+
+
+def write_objs(items, workers=0):
+    """ Write [(path, MeshBuffers)], split over worker processes (one per
+    core when workers is 0) that get their meshes as packed .npz chunks """
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        for filepath, buffers in items:
+            mesh_io.write_obj(filepath, buffers)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        processes = []
+        for worker in range(workers):
+            chunk = os.path.join(directory, f"chunk_{worker}.npz")
+            mesh_io.save_chunk(chunk, items[worker::workers])
+            processes.append(subprocess.Popen(
+                [sys.executable, mesh_io.__file__, chunk],
+                stderr=subprocess.PIPE))
+        errors = [
+            process.communicate()[1].decode(errors="replace")
+            for process in processes]
+        for process, error in zip(processes, errors):
+            if process.returncode:
+                raise RuntimeError(f"OBJ export worker failed: {error}")
+
+
+def export_sequence(obj, directory, frame_range=None, workers=0, use_uvs=True):
+    """ Write each drawing shown (by a key, or on a frame of frame_range)
+    once as a numbered OBJ, plus a frame -> file manifest; return the
+    manifest path """
+    directory = bpy.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    modifier = Modifier(obj)
+    frames = sequence_frames(modifier, frame_range)
+    files = {
+        index: f"{obj.name}_{index:04}.obj" for index in sorted(set(frames.values()))}
+    write_objs([
+        (os.path.join(directory, filename),
+         drawing_buffers(modifier.get_object(index), use_uvs=use_uvs))
+        for index, filename in files.items()], workers=workers)
+    manifest = os.path.join(directory, f"{obj.name}_manifest.json")
+    with open(manifest, 'w') as manifest_file:
+        json.dump({
+            "object": obj.name,
+            "drawings": {str(index): filename for index, filename in files.items()},
+            "frames": {
+                str(frame): files[index] for frame, index in sorted(frames.items())},
+            }, manifest_file, indent=1)
+    return manifest
+
+
+def natural_key(filepath):
+    """ frame_2 before frame_10 """
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r"(\d+)", os.path.basename(filepath))]
+
+
+def sequence_files(directory, pattern="*"):
+    """ Supported mesh files in directory matching pattern, in frame order """
+    files = glob.glob(os.path.join(bpy.path.abspath(directory), pattern))
+    return sorted(
+        (f for f in files if os.path.splitext(f)[1].lower() in mesh_io.READERS),
+        key=natural_key)
+
+
+class SequenceImport():
+    """ Parses files on a thread pool while the main thread turns the ones
+    that are ready into drawings and keys, in file order and in batches """
+
+    def __init__(
+            self, context, files, frame_start, frame_step=1, threads=0,
+            batch=32):
+        self.files = files
+        self.frame_start = frame_start
+        self.frame_step = frame_step
+        self.batch = batch
+        threads = threads or min(32, (os.cpu_count() or 1) + 4)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        # Bound the parsed meshes waiting for the main thread
+        self.window = 4 * threads + batch
+        self.pending = deque()
+        self.submitted = 0
+        self.done = 0
+        self.errors = []
+        # Key into this object even if another one becomes active meanwhile
+        self.obj = context.object
+        self.template, self.own_template = template_mesh(
+            Modifier(self.obj).get_object())
+        self.fill()
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def imported(self):
+        """ Files keyed so far """
+        return self.done - len(self.errors)
+
+    def fill(self):
+        while self.submitted < len(self.files) and len(self.pending) < self.window:
+            self.pending.append(
+                self.pool.submit(mesh_io.read_mesh, self.files[self.submitted]))
+            self.submitted += 1
+
+    def step(self, context, block=False):
+        """ Key what is parsed (waiting for a full batch if block), return
+        whether any files are left """
+        items = []
+        while self.pending and len(items) < self.batch and (
+                block or self.pending[0].done()):
+            future = self.pending.popleft()
+            filepath = self.files[self.done]
+            frame = self.frame_start + self.done * self.frame_step
+            self.done += 1
+            self.fill()
+            try:
+                buffers = future.result()
+            except (OSError, ValueError) as e:
+                self.errors.append(str(e))
+                continue
+            if not mesh_io.has_faces(buffers):
+                self.errors.append(f"{filepath}: no faces or a face under 3 corners")
+                continue
+            items.append((mesh_from_buffers(
+                os.path.basename(filepath), buffers, template=self.template), frame))
+        if items:
+            with context.temp_override(object=self.obj, active_object=self.obj):
+                animation.insert_keyframes(context, items, use_copy=False)
+        return self.done < len(self.files)
+
+    def run(self, context):
+        """ Import everything without giving control back """
+        try:
+            while self.step(context, block=True):
+                pass
+        finally:
+            self.close()
+
+    def close(self, cancel=False):
+        """ Stop the pool (dropping files not parsed yet if cancel) and let
+        go of the template """
+        self.pool.shutdown(wait=not cancel, cancel_futures=cancel)
+        self.pending.clear()
+        if self.own_template:
+            bpy.data.meshes.remove(self.template)
+            self.own_template = False
+
+    def cancel(self):
+        self.close(cancel=True)
+
+
+# Live Link
+
+
+def file_stamp(filepath):
+    stat = os.stat(filepath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def live_update(obj, filepath):
+    """ Reparse filepath into the current drawing of obj, only replacing
+    positions when the topology still matches """
+    buffers = mesh_io.read_obj(filepath)
+    if not mesh_io.has_faces(buffers):
+        raise ValueError(f"{filepath}: no faces or a face under 3 corners")
+    drawing = Modifier(obj).get_object()
+    shown = obj.data == drawing.data
+    mesh = modifier_data.unshare(drawing)
+    if same_topology(mesh, buffers):
+        set_positions(mesh, buffers.positions)
+        if shown:
+            obj.data = mesh
+        return
+    new_mesh = mesh_from_buffers(mesh.name, buffers, template=mesh)
+    drawing.data = new_mesh
+    if shown:
+        obj.data = new_mesh
+    if not mesh.users:
+        bpy.data.meshes.remove(mesh)
+
+
+def poll_live_links():
+    """ Timer: reimport linked files whose modification time or size
+    changed and then held still for a poll, so editors are done saving;
+    stops itself once nothing is linked """
+    for name, (filepath, stamp, seen) in list(live_links.items()):
+        obj = bpy.data.objects.get(name)
+        if not obj or not is_stop_motion(obj):
+            del live_links[name]
+            continue
+        if obj.mode != 'OBJECT':
+            continue # Edit mode would overwrite us, try again later
+        try:
+            current = file_stamp(filepath)
+        except OSError:
+            continue
+        if current == stamp:
+            continue
+        live_links[name] = (filepath, stamp, current)
+        if current != seen:
+            continue # Still being written
+        live_links[name] = (filepath, current, current)
+        try:
+            live_update(obj, filepath)
+        except (OSError, ValueError) as e:
+            # Probably caught the editor mid save, the next save retries
+            print(f"Warning: {e}: ", filepath)
+    return LIVE_INTERVAL if live_links else None
+
+
+def live_link(obj, filepath):
+    try:
+        stamp = file_stamp(filepath)
+    except OSError:
+        stamp = None
+    live_links[obj.name] = (filepath, stamp, stamp)
+    if not bpy.app.timers.is_registered(poll_live_links):
+        bpy.app.timers.register(poll_live_links, first_interval=LIVE_INTERVAL)
+
+
+def live_unlink(obj=None):
+    if obj is None:
+        live_links.clear()
+    else:
+        live_links.pop(obj.name, None)
+    if not live_links and bpy.app.timers.is_registered(poll_live_links):
+        bpy.app.timers.unregister(poll_live_links)
+
+
+@persistent
+def live_link_load(*args):
+    """ Links belong to the file they were made in """
+    live_unlink()
+
+
+class OBJECT_OT_stop_motion_obj_live_link(StopMotionOperator):
+    """Toggle reimporting the OBJ file into the current drawing whenever
+    it is saved"""
+    bl_idname = "object.stop_motion_obj_live_link"
+    bl_label = "Live OBJ Link"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        obj = context.object
+        if obj.name in live_links:
+            live_unlink(obj)
+            self.report({'INFO'}, f"{obj.name} unlinked")
+            return {'FINISHED'}
+        if not context.blend_data.filepath:
+            self.report({'WARNING'}, "Save Blend file first")
+            return {'CANCELLED'}
+        filepath = path(context)
+        live_link(obj, filepath)
+        self.report({'INFO'}, f"{obj.name} follows {filepath}")
+        return {'FINISHED'}
+
+
 class OBJECT_OT_import_stop_motion_obj(StopMotionOperator):
     """Import obj as a key drawing"""
     bl_idname = "object.import_stop_motion_obj"
@@ -49,29 +417,20 @@ class OBJECT_OT_import_stop_motion_obj(StopMotionOperator):
         if not os.path.isfile(filepath):
             self.report({'WARNING'}, "No OBJ; Export something first")
             return {'CANCELLED'}
-        stop_motion_object = context.object
-        preferences = context.preferences.addons[__package__].preferences
-
-        bpy.ops.wm.obj_import(
-            filepath=filepath,
-            clamp_size=0,
-
-            forward_axis='Y', up_axis='Z',
-
-            import_vertex_groups=False, validate_meshes=False)
-
-
-        imported_objects = bpy.context.selected_objects
-
-
-        stop_motion_object.select_set(True)
-        context.view_layer.objects.active = stop_motion_object
-
-        bpy.ops.object.keyframe_stop_motion(use_copy=False)
-        for ob in imported_objects:
-            if ob is not stop_motion_object:
-                bpy.data.objects.remove(ob, do_unlink=True)
-
+        try:
+            buffers = mesh_io.read_obj(filepath)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if not mesh_io.has_faces(buffers):
+            self.report({'ERROR'}, f"{filepath}: no faces or a face under 3 corners")
+            return {'CANCELLED'}
+        template, temporary = template_mesh(Modifier(context.object).get_object())
+        mesh = mesh_from_buffers(
+            os.path.basename(filepath), buffers, template=template)
+        if temporary:
+            bpy.data.meshes.remove(template)
+        animation.insert_keyframe(context, mesh, use_copy=False)
         return {'FINISHED'}
 
 
@@ -91,7 +450,10 @@ class OBJECT_OT_export_stop_motion_obj(StopMotionOperator):
         preferences = context.preferences.addons[__package__].preferences
         mode = stop_motion_object.mode
         modes.set_object(mode)
-        data = Modifier(stop_motion_object).get_object().data
+        drawing = Modifier(stop_motion_object).get_object()
+        packed = bool(drawing.get(modifier_data.PACKED_PROP))
+        # Export a copy of a packed drawing rather than unpack it for good
+        data = modifier_data.unpacked_mesh(drawing) if packed else drawing.data
 
         export_object = bpy.data.objects.new(
             name=f"{stop_motion_object.name}_export",object_data=data)
@@ -129,6 +491,8 @@ class OBJECT_OT_export_stop_motion_obj(StopMotionOperator):
             smooth_group_bitflags=False,)
 
         bpy.data.objects.remove(export_object)
+        if packed:
+            bpy.data.meshes.remove(data)
 
         stop_motion_object.select_set(True)
         context.view_layer.objects.active = stop_motion_object
@@ -138,12 +502,134 @@ class OBJECT_OT_export_stop_motion_obj(StopMotionOperator):
         return {'FINISHED'}
 
 
+class OBJECT_OT_export_stop_motion_sequence(StopMotionOperator):
+    """Export every drawing once as a numbered OBJ sequence with a frame
+    manifest"""
+    bl_idname = "object.export_stop_motion_sequence"
+    bl_label = "Export OBJ Sequence"
+    bl_options = {'REGISTER'}
+
+    directory: bpy.props.StringProperty(subtype='DIR_PATH')
+    use_frame_range: bpy.props.BoolProperty(
+        name="Scene Frame Range",
+        description="Export the drawing of every frame in the scene range "
+        "instead of every keyed drawing", default=False)
+    workers: bpy.props.IntProperty(
+        name="Workers", description="Export processes, 0 for one per core",
+        default=0, min=0, soft_max=32)
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        preferences = context.preferences.addons[__package__].preferences
+        frame_range = (
+            (scene.frame_start, scene.frame_end) if self.use_frame_range else None)
+        try:
+            manifest = export_sequence(
+                context.object, self.directory, frame_range=frame_range,
+                workers=self.workers, use_uvs=preferences.use_uvs)
+        except (KeyError, OSError, RuntimeError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Wrote {manifest}")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_import_stop_motion_sequence(StopMotionOperator):
+    """Import a folder of OBJ, PLY or STL files as consecutive key drawings"""
+    bl_idname = "object.import_stop_motion_sequence"
+    bl_label = "Import Mesh Sequence"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    directory: bpy.props.StringProperty(subtype='DIR_PATH')
+    pattern: bpy.props.StringProperty(
+        name="Pattern", description="Files to import, e.g. frame_*.ply",
+        default="*")
+    frame_step: bpy.props.IntProperty(
+        name="Frame Step", description="Frames between drawings",
+        default=1, min=1, soft_max=10)
+    threads: bpy.props.IntProperty(
+        name="Threads", description="Parsing threads, 0 for automatic",
+        default=0, min=0, soft_max=32)
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        files = sequence_files(self.directory, self.pattern)
+        if not files:
+            self.report({'WARNING'}, "No OBJ, PLY or STL files found")
+            return {'CANCELLED'}
+        self.importer = SequenceImport(
+            context, files, context.scene.frame_current,
+            frame_step=self.frame_step, threads=self.threads)
+        if bpy.app.background:
+            self.importer.run(context)
+            return self.finish(context)
+        window_manager = context.window_manager
+        self.timer = window_manager.event_timer_add(0.05, window=context.window)
+        window_manager.progress_begin(0, len(files))
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.importer.cancel()
+            self.cleanup(context)
+            self.report(
+                {'WARNING'},
+                f"Cancelled after {self.importer.done} of {len(self.importer)} files")
+            if self.importer.imported:
+                return {'FINISHED'} # Keys were added, keep them undoable
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        more = False
+        try:
+            more = self.importer.step(context)
+        finally:
+            if not more: # Done, or something escaped: don't leave anything behind
+                self.importer.close()
+                self.cleanup(context)
+        if more:
+            context.window_manager.progress_update(self.importer.done)
+            context.workspace.status_text_set(
+                f"Importing {self.importer.done}/{len(self.importer)}, Esc to cancel")
+            return {'RUNNING_MODAL'}
+        return self.finish(context)
+
+    def cleanup(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self.timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+
+    def finish(self, context):
+        for error in self.importer.errors:
+            self.report({'WARNING'}, error)
+        self.report({'INFO'}, f"Imported {self.importer.imported} files")
+        return {'FINISHED'}
+
+
 def register():
     bpy.utils.register_class(OBJECT_OT_import_stop_motion_obj)
+    bpy.utils.register_class(OBJECT_OT_import_stop_motion_sequence)
     bpy.utils.register_class(OBJECT_OT_export_stop_motion_obj)
+    bpy.utils.register_class(OBJECT_OT_export_stop_motion_sequence)
+    bpy.utils.register_class(OBJECT_OT_stop_motion_obj_live_link)
+    bpy.app.handlers.load_post.append(live_link_load)
 
 
 def unregister():
+    bpy.app.handlers.load_post.remove(live_link_load)
+    live_unlink()
+    bpy.utils.unregister_class(OBJECT_OT_stop_motion_obj_live_link)
+    bpy.utils.unregister_class(OBJECT_OT_import_stop_motion_sequence)
+    bpy.utils.unregister_class(OBJECT_OT_export_stop_motion_sequence)
     bpy.utils.unregister_class(OBJECT_OT_import_stop_motion_obj)
     bpy.utils.unregister_class(OBJECT_OT_export_stop_motion_obj)
 
@@ -21,19 +21,66 @@ if "bpy" in locals():
     import importlib
     importlib.reload(update_handler)
     importlib.reload(modifier_data)
-    importlib.reload(json_nodes)
     importlib.reload(version)
     importlib.reload(modes)
+    importlib.reload(node_library)
+    importlib.reload(lookup)
 else:
     from . import update_handler
     from . import modifier_data
-    from . import json_nodes
     from . import version
     from . import modes
+    from . import node_library
+    from . import lookup
 
 import bpy
-import os
-from .modifier_data import Modifier, StopMotionOperator
+from collections import namedtuple
+from bpy.app.handlers import persistent
+from .modifier_data import Modifier, StopMotionOperator, is_stop_motion
+
+ENGINES = (
+    ('OBJECTS', "Object per Skin",
+     "One helper object, material and NLA strip per onion skin"),
+    ('SINGLE', "Single Object",
+     "All onion skins drawn by one helper object and geometry nodes modifier"),
+    )
+
+# Point attributes of the single object engine, one point per onion skin
+OFFSET = "onion_offset"
+DRAWING = "drawing"
+COLOR = "onion_color"
+OPACITY = "onion_opacity"
+SKIN_ATTRIBUTES = (
+    (OFFSET, 'INT'), (DRAWING, 'INT'), (COLOR, 'FLOAT_COLOR'), (OPACITY, 'FLOAT'))
+SOURCE_PROP = "STPMO_onion_source"
+
+OnionState = namedtuple(
+    "OnionState", ("enable", "engine", "offset", "opacity", "count", "color"))
+
+
+def onion_state(settings):
+    """ Hashable snapshot of StopMotionOnionSkinSettings """
+    return OnionState(
+        settings.enable, settings.engine, settings.frame_offset,
+        settings.opacity, (settings.before, settings.after),
+        (tuple(settings.before_color), tuple(settings.after_color)))
+
+
+def skin_parameters(state, side, index):
+    """ (offset, color, opacity) of one onion skin, side 0 is before """
+    count = state.count[side]
+    sign = -1 if side == 0 else 1
+    offset = sign * (state.offset + state.offset * index)
+    opacity = state.opacity * (count - index) / count
+    return offset, state.color[side], opacity
+
+
+def skin_name(source, offset, index):
+    return f"{version.onion_prefix()}{'+' if offset > 0 else '-'}_{index:02}_{source.name}"
+
+
+def batch_name(source):
+    return f"{version.onion_prefix()}all_{source.name}"
 
 
 class OnionCollection():
@@ -84,33 +131,32 @@ class OnionCollection():
         self.scene.collection.children.unlink(self.collection)
 
 class OnionMaterial():
-    """Wrapper for Onion Skin Material"""
+    """Wrapper for a pooled Onion Skin Material: one per color and opacity,
+    shared by every skin that looks the same, whatever object it is for"""
 
     props = {
         "use_nodes": True, "blend_method": 'BLEND', "shadow_method": 'NONE',
-        "use_backface_culling": True, "roughness": 1, "use_fake_user": True
+        "use_backface_culling": True, "roughness": 1,
         }
+    # (shader node type, node properties, ((output, group input), ...))
+    sources = ()
 
-    def __init__(self, offset, index, color, opacity):
-
-        self.forward = offset > 0
-        self.index = index
+    def __init__(self, color=(0.0, 0.0, 0.0), opacity=1.0):
+        # Rounded so near identical skins share, and the name says it all
+        self.color = [round(channel * 255) / 255 for channel in color]
+        self.opacity = round(opacity, 3)
         self.set_name()
         materials = bpy.data.materials
         self.material = materials.get(self.name)
         if self.material:
-            self.inputs = self.material.node_tree.nodes['Group'].inputs
-            self.color = color
-            self.opacity = opacity
             return # Material exists, we're done here
         # Create and setup new material
         self.material = materials.new(self.name)
         version.onion_tag(self.material)
         self.set_properties()
         self.set_node_tree()
-        self.inputs = self.material.node_tree.nodes['Group'].inputs
-        self.color = color
-        self.opacity = opacity
+        self.set_color()
+        release_materials()
 
     def set_node_tree(self):
         material = self.material
@@ -120,14 +166,28 @@ class OnionMaterial():
                 material.node_tree.nodes.remove(node)
         # create group node
         group_node = material.node_tree.nodes.new(type='ShaderNodeGroup')
-        filepath = os.path.join(os.path.dirname(__file__), "material.json")
-        onion_group = json_nodes.read_node("Oniony", filepath, tree_type="ShaderNodeTree")
+        onion_group = node_library.read_group("Oniony")
         group_node.node_tree = onion_group
         # link the group to the material output
         link = material. node_tree.links.new(
             group_node.outputs['Shader'],
             material.node_tree.nodes['Material Output'].inputs['Surface'])
         self.inputs = group_node.inputs
+        # feed color and opacity from outside the material
+        for node_type, props, links in self.sources:
+            node = material.node_tree.nodes.new(type=node_type)
+            for prop, value in props.items():
+                setattr(node, prop, value)
+            for output, socket in links:
+                material.node_tree.links.new(node.outputs[output], self.inputs[socket])
+
+    def set_color(self):
+        """Shader inputs and the solid viewport color, set once"""
+        for index, value in enumerate(self.color):
+            self.inputs['Color'].default_value[index] = value
+            self.material.diffuse_color[index] = value
+        self.inputs['Opacity'].default_value = self.opacity
+        self.material.diffuse_color[3] = self.opacity
 
     def set_properties(self, props=None):
         if not props:
@@ -135,29 +195,36 @@ class OnionMaterial():
         for prop, value in self.props.items():
             setattr(self.material, prop, value)
 
+    def set_name(self):
+        red, green, blue = (round(channel * 255) for channel in self.color)
+        self.name = (
+            f"{version.onion_prefix()}#{red:02x}{green:02x}{blue:02x}_"
+            f"{self.opacity:.3f}")
 
-    @property
-    def opacity(self):
-        return self.inputs['Opacity'].default_value
 
-    @opacity.setter
-    def opacity(self, opacity):
-        self.material.diffuse_color[3] = opacity
-        self.inputs['Opacity'].default_value = opacity
+class OnionAttributeMaterial(OnionMaterial):
+    """Single object engine Material, color and opacity come from attributes"""
 
-    @property
-    def color(self):
-        return [self.inputs['Color'].default_value[i] for i in range(3)]
+    props = {**OnionMaterial.props, "use_fake_user": True}
+    sources = (
+        ('ShaderNodeAttribute', {"attribute_name": COLOR}, (('Color', 'Color'),)),
+        ('ShaderNodeAttribute', {"attribute_name": OPACITY}, (('Fac', 'Opacity'),)),
+        )
 
-    @color.setter
-    def color(self, color):
-        """Set RGB to a 3 float array"""
-        for i, value in enumerate(color):
-            self.inputs['Color'].default_value[i] = value
-            self.material.diffuse_color[i] = value
+    def set_color(self):
+        pass # Per point, see sources
 
     def set_name(self):
-        self.name = f"{version.onion_prefix()}{'+' if self.forward else '-'}_{self.index:02}"
+        self.name = f"{version.onion_prefix()}attributes"
+
+
+def release_materials():
+    """ Pooled materials go away once no skin uses them; so do the per side
+    and object color materials of older files """
+    attributes = f"{version.onion_prefix()}attributes"
+    for material in bpy.data.materials:
+        if version.is_onion(material) and material.name != attributes:
+            material.use_fake_user = False
 
 
 class OnionSkin():
@@ -167,11 +234,12 @@ class OnionSkin():
     copy_props = ["parent", "parent_type", "matrix_parent_inverse", "matrix_world"]
 
     def set_name(self):
-        self.name = f"{version.onion_prefix()}{'+' if self.forward else '-'}_{self.index:02}_{self.source.name}"
+        self.name = skin_name(self.source, self.offset, self.index)
 
     def __init__(self, scene, source, offset, index, color, opacity, create):
         """ Create an onion skin object """
         self.forward = offset > 0
+        self.scene = scene
         self.source = source
         self.offset = offset
         self.index = index
@@ -200,38 +268,29 @@ class OnionSkin():
         return True if self.obj else False
 
     def modifier(self):
-        # Create the material
-        self.material = OnionMaterial(
-            self.offset, self.index, self.color, self.opacity)
-        if Modifier(self.obj):
-            return
-        # add the modifiers
-        for name, json_path, modname in (
-                ("MeshKey", "modifier.json", Modifier.name),
-                ("Materialize", "materializer.json", "Materializer")):
-            node_group = json_nodes.read_node(
-                name, os.path.join(os.path.dirname(__file__), json_path))
-            modifier = self.obj.modifiers.new(modname, 'NODES')
-            modifier.node_group = node_group
-        # Assign material to second modifier
-        identifier = modifier.node_group.interface.items_tree['Material'].identifier
-        modifier[identifier] = self.material.material
-        # Copy modifier settings from source
+        # Pooled material, shared with every skin of this color and opacity
+        self.material = OnionMaterial(self.color, self.opacity)
         target_modifier = Modifier(self.source)
-        my_modifier = Modifier(self.obj)
-        my_modifier.collection = target_modifier.collection
-        my_modifier.index = target_modifier.index + self.offset
-
-        # Adjust object viewport properties to match material
+        if not is_stop_motion(self.obj):
+            # add the modifiers, with the same lookup as the source
+            mesh_key = modifier_data.LOOKUPS[target_modifier.lookup]
+            for name, modname in (
+                    (mesh_key, Modifier.name), ("Materialize", "Materializer")):
+                node_group = node_library.read_group(name)
+                modifier = self.obj.modifiers.new(modname, 'NODES')
+                modifier.node_group = node_group
+            # Copy modifier settings from source
+            my_modifier = Modifier(self.obj)
+            my_modifier.collection = target_modifier.collection
+            my_modifier.index = target_modifier.index + self.offset
+        sync_skin(
+            self.obj, target_modifier, self.offset, self.scene.frame_current)
+        # Assign material to second modifier, also moving skins of older
+        # files off their per side materials
+        set_material(self.obj, self.material.material)
 
     def animation(self):
-        # do the nla of the action, offset it by offset
-        action = self.source.animation_data.action
-        self.obj.animation_data_clear()
-        animation_data = self.obj.animation_data_create()
-        nla_track = animation_data.nla_tracks.new()
-        strip = nla_track.strips.new(
-            action.name, int(action.frame_range[0] - self.offset) , action)
+        offset_animation(self.obj, self.source.animation_data.action, self.offset)
 
     def set_properties(self, props=None):
         if not props:
@@ -256,6 +315,188 @@ class OnionSkin():
                 setattr(self.obj, prop, getattr(self.source, prop))
 
 
+def sync_skin(skin, source_modifier, offset, frame):
+    """ Follow the lookup of the source; Object lookup skins have no keys
+    of their own, so they are pointed at the drawing the source shows
+    offset frames away """
+    if not is_stop_motion(skin):
+        return
+    if Modifier(skin).lookup != source_modifier.lookup:
+        lookup.set_lookup(skin, source_modifier.lookup)
+    Modifier(skin).sync_drawing(source_modifier.index_at(frame + offset))
+
+
+def offset_animation(skin, action, offset):
+    """ Replace the skin animation with one NLA strip of action, offset by
+    offset frames """
+    skin.animation_data_clear()
+    animation_data = skin.animation_data_create()
+    nla_track = animation_data.nla_tracks.new()
+    strip = nla_track.strips.new(
+        action.name, int(action.frame_range[0] - offset) , action)
+
+
+class OnionSkinBatch():
+    """Creates or gets the single helper object drawing all onion skins"""
+
+    props = OnionSkin.props
+    copy_props = OnionSkin.copy_props
+    modname = "Onion Skins"
+
+    def set_name(self):
+        self.name = batch_name(self.source)
+
+    def __init__(self, scene, source, skins, create):
+        """ skins is a list of (offset, color, opacity), one per onion skin """
+        self.source = source
+        self.collection = OnionCollection(scene, source)
+        self.set_name()
+        objects = bpy.data.objects
+        self.obj = objects.get(self.name)
+        if not create:
+            if self.obj:
+                self.delete()
+            return
+        if not self.obj:
+            self.obj = objects.new(
+                name=self.name, object_data=bpy.data.meshes.new(self.name))
+            version.onion_tag(self.obj)
+        self.obj[SOURCE_PROP] = source
+        self.collection.link(self.obj)
+        self.modifier()
+        self.set_properties()
+        self.set_transform()
+        self.set_skins(skins)
+        self.update(scene.frame_current)
+
+    def __bool__(self):
+        return True if self.obj else False
+
+    def delete(self):
+        self.collection.unlink(self.obj)
+
+    def set_transform(self):
+        if self.obj and self.source:
+            for prop in self.copy_props:
+                setattr(self.obj, prop, getattr(self.source, prop))
+
+    def modifier(self):
+        modifier = self.obj.modifiers.get(self.modname)
+        if not modifier:
+            modifier = self.obj.modifiers.new(self.modname, 'NODES')
+            modifier.node_group = node_library.read_group("OnionSkins")
+        # The Collection input is up to pick_drawings, see update
+        identifiers = modifier_data.get_socket_identifiers(modifier.node_group)
+        modifier[identifiers['Material']] = OnionAttributeMaterial().material
+
+    def set_properties(self):
+        for prop, value in self.props.items():
+            if type(value) is dict:
+                sub_obj = getattr(self.obj, prop)
+                for sub_prop, sub_value in value.items():
+                    setattr(sub_obj, sub_prop, sub_value)
+            else:
+                setattr(self.obj, prop, value)
+
+    def set_skins(self, skins):
+        write_skins(self.obj, skins)
+
+    def update(self, frame):
+        pick_drawings(self.obj, self.source, frame)
+
+
+def write_skins(obj, skins):
+    """ One point per skin, carrying its offset, color and opacity """
+    mesh = obj.data
+    if len(mesh.vertices) != len(skins):
+        mesh.clear_geometry()
+        mesh.vertices.add(len(skins))
+    attributes = mesh.attributes
+    for name, data_type in SKIN_ATTRIBUTES:
+        if name not in attributes:
+            attributes.new(name, data_type, 'POINT')
+    attributes[OFFSET].data.foreach_set(
+        "value", [offset for offset, color, opacity in skins])
+    attributes[COLOR].data.foreach_set(
+        "color", [value for offset, color, opacity in skins
+                  for value in (*color, 1.0)])
+    attributes[OPACITY].data.foreach_set(
+        "value", [opacity for offset, color, opacity in skins])
+    mesh.update()
+
+
+def picked_collection(helper):
+    """ Collection holding only the drawings the skins of helper show """
+    name = f"{helper.name}_picks"
+    collection = bpy.data.collections.get(name)
+    if not collection:
+        collection = bpy.data.collections.new(name)
+        version.onion_tag(collection)
+    return collection
+
+
+def pick(picks, collection, indices):
+    """ Link the drawings for indices into picks, found by index like the
+    Object lookup does, and return their places in the name order the
+    OnionSkins group instances them in """
+    drawings = [modifier_data.find_drawing(collection, index) for index in indices]
+    wanted = {drawing for drawing in drawings if drawing}
+    linked = set(picks.objects)
+    for drawing in linked - wanted:
+        picks.objects.unlink(drawing)
+    for drawing in wanted - linked:
+        picks.objects.link(drawing)
+    order = sorted(wanted, key=lambda drawing: drawing.name)
+    places = {drawing: place for place, drawing in enumerate(order)}
+    return [places.get(drawing, 0) for drawing in drawings]
+
+
+def set_batch_collection(helper, collection):
+    """ Point the OnionSkins modifier of helper at collection """
+    modifier = helper.modifiers.get(OnionSkinBatch.modname)
+    if modifier:
+        identifier = modifier.node_group.interface.items_tree['Collection'].identifier
+        if modifier[identifier] != collection:
+            modifier[identifier] = collection
+
+
+def pick_drawings(obj, source, frame):
+    """ Point every skin at the drawing shown offset frames away; the
+    drawings of an Object lookup source are found by index, as its
+    collection may only hold some of them (offloaded takes) """
+    mesh = obj.data
+    attributes = mesh.attributes
+    if OFFSET not in attributes or DRAWING not in attributes:
+        return
+    count = len(mesh.vertices)
+    offsets = [0] * count
+    attributes[OFFSET].data.foreach_get("value", offsets)
+    modifier = Modifier(source)
+    drawings = [modifier.index_at(frame + offset) for offset in offsets]
+    collection = modifier.collection
+    if modifier.lookup == 'OBJECT':
+        picks = picked_collection(obj)
+        drawings = pick(picks, collection, drawings)
+        collection = picks
+    set_batch_collection(obj, collection)
+    current = [0] * count
+    attributes[DRAWING].data.foreach_get("value", current)
+    if current != drawings: # Most frames have no key in reach
+        attributes[DRAWING].data.foreach_set("value", drawings)
+        mesh.update()
+
+
+def onion_batches(scene):
+    """ Single object engine helpers in scene with their source object """
+    for collection in scene.collection.children:
+        if not version.is_onion(collection):
+            continue
+        for obj in collection.objects:
+            source = obj.get(SOURCE_PROP)
+            if source and is_stop_motion(source):
+                yield obj, source
+
+
 class OnionSkinManager():
     """handle onion skins for a given object"""
 
@@ -263,45 +504,204 @@ class OnionSkinManager():
 
     def __init__(self,scene, stop_motion_object):
         self.stop_motion_object = stop_motion_object
-        settings  = stop_motion_object.onion_skin_settings
-        self.enable = settings.enable
-        self.opacity = settings.opacity
-        self.offset = settings.frame_offset
-        self.count = (settings.before, settings.after)
-        self.color = (settings.before_color, settings.after_color)
+        self.state = onion_state(stop_motion_object.onion_skin_settings)
+        self.enable = self.state.enable
+        self.count = self.state.count
+        self.engine = self.state.engine
         self.scene = scene
         self.onion_skins_load()
 
     def __bool__(self):
-        return True if any([items for items in self.objects]) else False
+        return True if any([items for items in self.objects]) or self.batch else False
 
     def onion_skins_load(self):
+        single = self.engine == 'SINGLE'
+        if self.enable:
+            node_library.ensure_groups(
+                ("OnionSkins", "Oniony") if single else
+                ("MeshKey", "MeshKeyObject", "Materialize", "Oniony"))
+        skins = []
         self.objects =[[],[]]
         for side, items in enumerate(self.objects):
 
             for index in range(self.maximum):
                 create = self.enable and index < self.count[side]
-                sign = -1 if side == 0 else 1
-                # set proper time offset
-                # set proper opacity offset
-                opacity = self.opacity * (self.count[side] - index) / self.count[side]
-                offset = sign * (self.offset + self.offset * index)
+                offset, color, opacity = skin_parameters(self.state, side, index)
+                if create:
+                    skins.append((offset, color, opacity))
                 onion_skin_object = OnionSkin(
                     self.scene,
                     self.stop_motion_object, offset ,
-                    index, self.color[side], opacity, create)
+                    index, color, opacity, create and not single)
                 if onion_skin_object:
                     items.append(onion_skin_object)
+        self.batch = OnionSkinBatch(
+            self.scene, self.stop_motion_object, skins, self.enable and single)
 
     def refresh(self):
         for side in self.objects:
             for onion_skin_object in side:
                 onion_skin_object.animation()
+        if self.batch:
+            self.batch.update(self.scene.frame_current)
 
     def onion_skins_unload(self):
         for items in self.objects:
             for onion_skin in items:
                 onion_skin.delete()
+        if self.batch:
+            self.batch.delete()
+
+# Reconciliation
+
+# Settings last applied per object pointer, dropped on undo and file load
+onion_states = {}
+
+
+def offset_strip(skin, source, offset):
+    """ Slide the existing NLA strip of a skin, False if there is none """
+    animation_data = skin.animation_data
+    action = source.animation_data.action if source.animation_data else None
+    if not action or not animation_data or not animation_data.nla_tracks:
+        return False
+    strips = animation_data.nla_tracks[0].strips
+    if not strips:
+        return False
+    strips[0].frame_start_ui = int(action.frame_range[0] - offset)
+    return True
+
+
+def set_material(skin, material):
+    """ Point the Materializer modifier of a skin at material """
+    modifier = skin.modifiers.get("Materializer")
+    if modifier:
+        identifier = modifier.node_group.interface.items_tree['Material'].identifier
+        modifier[identifier] = material
+
+
+def restyle(skin, color, opacity):
+    """ Swap the skin to the pooled material of its new look """
+    set_material(skin, OnionMaterial(color, opacity).material)
+    for channel, value in enumerate(color):
+        skin.color[channel] = value
+    skin.color[3] = opacity
+
+
+def reconcile_onion_skins(scene, source):
+    """ Apply the onion skin settings of source, touching only what changed
+    since they were last applied """
+    key = source.as_pointer()
+    old = onion_states.get(key)
+    new = onion_states[key] = onion_state(source.onion_skin_settings)
+    if old == new:
+        return
+    if old is None or not new.enable or old[:2] != new[:2]:
+        OnionSkinManager(scene, source)
+        return
+    if new.engine == 'SINGLE':
+        helper = bpy.data.objects.get(batch_name(source))
+        if not helper:
+            OnionSkinManager(scene, source)
+            return
+        write_skins(helper, [
+            skin_parameters(new, side, index)
+            for side in (0, 1) for index in range(new.count[side])])
+        pick_drawings(helper, source, scene.frame_current)
+        return
+    objects = bpy.data.objects
+    for side in (0, 1):
+        old_count, new_count = old.count[side], new.count[side]
+        # Opacity falls off over the count, so a count change restyles too
+        styled = (old.opacity, old_count, old.color[side]) == (
+            new.opacity, new_count, new.color[side])
+        for index in range(max(old_count, new_count)):
+            offset, color, opacity = skin_parameters(new, side, index)
+            skin = objects.get(skin_name(source, offset, index))
+            if index >= new_count or index >= old_count or not skin:
+                OnionSkin(
+                    scene, source, offset, index, color, opacity,
+                    index < new_count)
+                continue
+            if not styled:
+                restyle(skin, color, opacity)
+            if old.offset != new.offset and not offset_strip(skin, source, offset):
+                OnionSkin(scene, source, offset, index, color, opacity, True)
+
+
+@persistent
+def onion_state_reset(*args):
+    """ Pointers are not stable across undo and file loads """
+    onion_states.clear()
+    synced_ranges.clear()
+
+# Scene Sync
+
+# (action pointer, frame range) per object pointer at its last scene sync
+synced_ranges = {}
+
+
+def onion_sources(scene):
+    """ Tagged stop motion objects in scene with onion skins enabled """
+    for obj in scene.objects:
+        if (version.is_main(obj) and obj.onion_skin_settings.enable
+                and is_stop_motion(obj)):
+            yield obj
+
+
+def sync_scene_onion_skins(scene, force=False):
+    """ Refresh the onion skins of every enabled stop motion object in one
+    pass, skipping objects whose action frame range did not change """
+    objects = bpy.data.objects
+    for source in onion_sources(scene):
+        state = onion_state(source.onion_skin_settings)
+        if state.engine == 'SINGLE':
+            helper = objects.get(batch_name(source))
+            if helper:
+                pick_drawings(helper, source, scene.frame_current)
+            continue
+        animation_data = source.animation_data
+        action = animation_data.action if animation_data else None
+        if not action:
+            continue
+        key = source.as_pointer()
+        synced = (action.as_pointer(), tuple(action.frame_range))
+        if not force and synced_ranges.get(key) == synced:
+            continue # Strips still cover the whole action
+        synced_ranges[key] = synced
+        for side in (0, 1):
+            for index in range(state.count[side]):
+                offset = skin_parameters(state, side, index)[0]
+                skin = objects.get(skin_name(source, offset, index))
+                if skin:
+                    offset_animation(skin, action, offset)
+    sync_skin_drawings(scene)
+
+
+def sync_skin_drawings(scene):
+    """ Point the object per skin onion skins of scene at their drawings """
+    frame = scene.frame_current
+    objects = bpy.data.objects
+    for source in onion_sources(scene):
+        state = onion_state(source.onion_skin_settings)
+        if state.engine == 'SINGLE':
+            continue
+        source_modifier = Modifier(source)
+        for side in (0, 1):
+            for index in range(state.count[side]):
+                offset = skin_parameters(state, side, index)[0]
+                skin = objects.get(skin_name(source, offset, index))
+                if skin:
+                    sync_skin(skin, source_modifier, offset, frame)
+
+
+@persistent
+def onion_skin_frame(scene, *args):
+    """ Single object onion skins follow the frame without NLA strips, and
+    so do Object lookup skins """
+    for obj, source in onion_batches(scene):
+        pick_drawings(obj, source, scene.frame_current)
+    sync_skin_drawings(scene)
+
 # Operators
 
 
@@ -321,19 +721,28 @@ class OBJECT_OT_sync_onion_skins(StopMotionOperator):
         sync_onion_skins(context.scene, context.object)
         return {'FINISHED'}
 
+
+class OBJECT_OT_sync_scene_onion_skins(bpy.types.Operator):
+    """Re-sync Onion Skins of every Stop Motion Object in the Scene"""
+    bl_idname = "object.sync_scene_onion_skins"
+    bl_label = "Syncronize All Onion Skins"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        sync_scene_onion_skins(context.scene, force=True)
+        return {'FINISHED'}
+
 # Properties
 
 
 def onion_property_enable(self, context):
-    stop_motion_object = context.object
-    onion_skin_objects = OnionSkinManager(context.scene, stop_motion_object)
+    reconcile_onion_skins(context.scene, context.object)
 
 
 def onion_property_update(self, context):
     if not self.enable:
         return
-    stop_motion_object = context.object
-    onion_skin_objects = OnionSkinManager(context.scene, stop_motion_object)
+    reconcile_onion_skins(context.scene, context.object)
 
 
 class StopMotionOnionSkinSettings(bpy.types.PropertyGroup):
@@ -341,6 +750,9 @@ class StopMotionOnionSkinSettings(bpy.types.PropertyGroup):
 
     enable: bpy.props.BoolProperty(
         name="Enable", options=set(), default=False, update=onion_property_enable)
+    engine: bpy.props.EnumProperty(
+        name="Engine", description="How the Onion Skins are drawn",
+        items=ENGINES, options=set(), default='OBJECTS', update=onion_property_update)
     frame_offset: bpy.props.IntProperty(
         name="Frame Offset", description="Number of Frames between Onion Skins",
         options=set(), default=2, min=1, soft_max=5, max=20, update=onion_property_update)
@@ -364,15 +776,30 @@ class StopMotionOnionSkinSettings(bpy.types.PropertyGroup):
         min=0.0, max=1.0, size=3, update=onion_property_update)
 
 
+reset_handlers = (
+    bpy.app.handlers.undo_post, bpy.app.handlers.redo_post,
+    bpy.app.handlers.load_post)
+
+
 def register():
     bpy.utils.register_class(StopMotionOnionSkinSettings)
     bpy.types.Object.onion_skin_settings = bpy.props.PointerProperty(
         type=StopMotionOnionSkinSettings, name="Onion Skin Settings"
         )
     bpy.utils.register_class(OBJECT_OT_sync_onion_skins)
+    bpy.utils.register_class(OBJECT_OT_sync_scene_onion_skins)
+    bpy.app.handlers.frame_change_pre.append(onion_skin_frame)
+    for handler_list in reset_handlers:
+        handler_list.append(onion_state_reset)
 
 
 def unregister():
+    for handler_list in reset_handlers:
+        handler_list.remove(onion_state_reset)
+    bpy.app.handlers.frame_change_pre.remove(onion_skin_frame)
+    onion_states.clear()
+    synced_ranges.clear()
+    bpy.utils.unregister_class(OBJECT_OT_sync_scene_onion_skins)
     bpy.utils.unregister_class(OBJECT_OT_sync_onion_skins)
     del bpy.types.Object.onion_skin_settings
     bpy.utils.unregister_class(StopMotionOnionSkinSettings)
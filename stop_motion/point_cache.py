@@ -0,0 +1,146 @@
+# Copyright 2022 Bassam Kurdali / urchn.org
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+"""
+Vertex caches (MDD and PC2) of a take whose drawings all share topology,
+positions are in object space like the OBJ operators
+"""
+
+if "bpy" in locals():
+    import importlib
+    importlib.reload(mesh_io)
+    importlib.reload(modifier_data)
+    importlib.reload(modes)
+    importlib.reload(obj_io)
+else:
+    from . import mesh_io
+    from . import modifier_data
+    from . import modes
+    from . import obj_io
+
+import bpy
+import numpy
+import os
+from .modifier_data import Modifier, StopMotionOperator
+
+FORMATS = (
+    ('MDD', "MDD", "Lightwave point cache, big endian with frame times"),
+    ('PC2', "PC2", "3ds Max point cache, little endian with start and rate"),
+)
+
+
+def read_positions(drawing, out):
+    """ foreach_get a drawing's positions (packed or not) into out """
+    attribute = drawing.get(modifier_data.PACKED_PROP)
+    if attribute:
+        drawing.data.attributes[attribute].data.foreach_get("vector", out)
+    else:
+        drawing.data.vertices.foreach_get("co", out)
+
+
+def cache_positions(obj, frames):
+    """ (frames, vertices, 3) positions of the drawing on each frame and
+    the frames whose drawing doesn't match the first frame's topology """
+    modifier = Modifier(obj)
+    indices = [modifier.index_at(frame) for frame in frames]
+    reference = obj_io.drawing_buffers(
+        modifier.get_object(indices[0]), use_uvs=False)
+    positions = numpy.empty(
+        (len(frames), len(reference.positions), 3), dtype=numpy.float32)
+    rows = {} # drawing index: first row holding it
+    mismatched = []
+    for row, (frame, index) in enumerate(zip(frames, indices)):
+        if index in rows:
+            positions[row] = positions[rows[index]]
+            continue
+        drawing = modifier.get_object(index)
+        if not obj_io.same_topology(drawing.data, reference):
+            mismatched.append(frame)
+            continue
+        read_positions(drawing, positions[row].reshape(-1))
+        rows[index] = row
+    return positions, mismatched
+
+
+def export_cache(obj, path, frame_range, fps, cache_format='MDD'):
+    """ Write the frames of frame_range as a vertex cache; return the
+    mismatched frames instead (writing nothing) if there are any """
+    start, end = frame_range
+    frames = range(start, end + 1)
+    positions, mismatched = cache_positions(obj, frames)
+    if mismatched:
+        return mismatched
+    if cache_format == 'MDD':
+        mesh_io.write_mdd(path, positions, [(frame - start) / fps for frame in frames])
+    else:
+        mesh_io.write_pc2(path, positions, start)
+    return []
+
+
+class OBJECT_OT_export_stop_motion_cache(StopMotionOperator):
+    """Export the scene frame range as an MDD or PC2 vertex cache, every
+    drawing must have the same topology"""
+    bl_idname = "object.export_stop_motion_cache"
+    bl_label = "Export Point Cache"
+    bl_options = {'REGISTER'}
+
+    filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+    cache_format: bpy.props.EnumProperty(
+        name="Format", items=FORMATS, default='MDD')
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = f"{context.object.name}.mdd"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        extension = f".{self.cache_format.lower()}"
+        filepath = bpy.path.ensure_ext(
+            os.path.splitext(bpy.path.abspath(self.filepath))[0], extension)
+        mode = context.object.mode
+        modes.set_object(mode) # Edit mode changes aren't in the mesh yet
+        try:
+            mismatched = export_cache(
+                context.object, filepath, (scene.frame_start, scene.frame_end),
+                scene.render.fps / scene.render.fps_base, self.cache_format)
+        except (KeyError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        finally:
+            modes.restore(mode, context.object)
+        for frame in mismatched:
+            self.report(
+                {'WARNING'}, f"Frame {frame}: topology differs from frame "
+                f"{scene.frame_start}")
+        if mismatched:
+            self.report(
+                {'ERROR'}, f"{len(mismatched)} frames can't be cached, "
+                "nothing written")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Wrote {filepath}")
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(OBJECT_OT_export_stop_motion_cache)
+
+
+def unregister():
+    bpy.utils.unregister_class(OBJECT_OT_export_stop_motion_cache)
@@ -33,6 +33,13 @@ class StopMotionPreferences(bpy.types.AddonPreferences):
         default=False
         )
 
+    deduplicate_on_insert: bpy.props.BoolProperty(
+        name="Share Unchanged Drawings",
+        description="New keyframes of an unchanged drawing share its mesh "
+        "until one of them is edited",
+        default=False
+        )
+
     use_smooth_groups: bpy.props.BoolProperty(
         name="Use Smooth Groups",
         default=False)
@@ -63,6 +70,7 @@ class StopMotionPreferences(bpy.types.AddonPreferences):
         layout.label(text="Stop Motion Preferences")
         layout.prop(self, "frame_offset")
         layout.prop(self, "tab_for_pie_menu")
+        layout.prop(self, "deduplicate_on_insert")
         layout.separator()
         layout.label(text="OBJ IO Preferences")
         layout.prop(self, "use_normals")
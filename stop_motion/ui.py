@@ -26,7 +26,7 @@ else:
     from . import modifier_data
 
 import bpy
-from .modifier_data import Modifier
+from .modifier_data import is_stop_motion
 
 # Keymaps
 
@@ -141,10 +141,25 @@ class StopMotionControls():
             {"use_copy": True}),
         ("screen.next_or_keyframe_stop_motion", "Next/New Keyframe", 'NEXT_KEYFRAME', {}),
         ("object.join_stop_motion", "Join Meshes", 'MOD_BOOLEAN', {}),
+        ("object.keyframe_stop_motion_batch", "Keyframe Selected", 'KEYFRAME_HLT', {}),
+    ]
+    data_operators = [
+        ("object.stop_motion_deduplicate", "Deduplicate", 'DUPLICATE', {}),
+        ("object.stop_motion_compact", "Remove Unused", 'TRASH', {}),
+        ("object.stop_motion_storage", "Pack Drawings", 'PACKAGE', {"storage": 'PACKED'}),
+        ("object.stop_motion_storage", "Unpack Drawings", 'UGLYPACKAGE', {"storage": 'MESHES'}),
+        ("object.stop_motion_offload", "Offload Drawings", 'LIBRARY_DATA_DIRECT', {}),
+        ("object.stop_motion_bring_back", "Bring Back Drawings", 'LIBRARY_DATA_BROKEN', {}),
     ]
     obj_operators = [
         ("object.export_stop_motion_obj", "Export to OBJ", 'CURRENT_FILE', {}),
         ("object.import_stop_motion_obj", "Import from OBJ", 'FILE', {}),
+        ("object.export_stop_motion_sequence", "Export OBJ Sequence", 'FILE_FOLDER', {}),
+        ("object.import_stop_motion_sequence", "Import Mesh Sequence", 'FILE_FOLDER', {}),
+        ("object.stop_motion_obj_live_link", "Live OBJ Link", 'LINKED', {}),
+        ("object.export_stop_motion_cache", "Export Point Cache", 'FILE_CACHE', {}),
+        ("object.export_stop_motion_drawings", "Export Drawing Cache", 'EXPORT', {}),
+        ("object.import_stop_motion_drawings", "Import Drawing Cache", 'IMPORT', {}),
     ]
 
 
@@ -162,14 +177,13 @@ class StopMotionPanel(bpy.types.Panel, AdapativePanel, StopMotionControls):
         layout = self.layout
 
         ob = context.object
-        mod = Modifier(ob)
 
         layout.use_property_split = True
 
         flow = layout.split()
         col = self.adaptive_col(flow)
 
-        if not mod:
+        if not is_stop_motion(ob):
             self.operator_button(
                 col, "object.add_stop_motion", "Initialize", 'PLUS', {})
             return
@@ -180,16 +194,25 @@ class StopMotionPanel(bpy.types.Panel, AdapativePanel, StopMotionControls):
         menu.toggle = False
         col.separator(factor=0.8)
 
-        for operator_list in (self.main_operators, self.obj_operators):
+        for operator_list in (
+                self.main_operators, self.data_operators, self.obj_operators):
             for operator_id, text, icon, props in operator_list:
                 self.operator_button(col, operator_id, text, icon, props)
             col.separator(factor=0.4)
 
+        self.operator_menu_enum(
+            col, "object.stop_motion_lookup", "Drawing Lookup", 'VIEWZOOM',
+            "lookup")
+        col.separator(factor=0.4)
+
         running = update_handler.is_running()
         icon = 'PLAY' if not running else 'SNAP_FACE'
         self.operator_button(
             col,
             "object.stop_motion_updater_toggle", "Toggle Updater", icon, {})
+        timing = update_handler.timing_report() if running else None
+        if timing and self.item_text(timing):
+            col.label(text=timing, icon='TIME')
         col.separator(factor=0.4)
 
         self.pop_over(
@@ -227,6 +250,7 @@ class OnionSkinSettingsPanel(bpy.types.Panel):
         layout.active = settings.enable
         col = layout.column(align=True)
         # layout.prop(settings, "enable")
+        col.prop(settings, "engine")
         col.prop(settings, "frame_offset")
         col.prop(settings, "opacity")
         layout.separator(factor=1.0)
@@ -242,6 +266,8 @@ class OnionSkinSettingsPanel(bpy.types.Panel):
         layout.separator(factor=.5)
         row = layout.row()
         row.operator("object.sync_onion_skins", text="Refresh", icon='FILE_REFRESH')
+        row.operator(
+            "object.sync_scene_onion_skins", text="Refresh All", icon='FILE_REFRESH')
         layout.separator(factor=1)
 
 
@@ -273,8 +299,7 @@ class VIEW3D_MT_PIE_StopMotion_Mode(bpy.types.Menu):
     def draw(self, context):
         layout = self.layout
         pie = layout.menu_pie()
-        modifier = Modifier(context.object)
-        if modifier:
+        if is_stop_motion(context.object):
             pie.operator_enum("object.stop_motion_mode", "mode")
         else:
             menu = pie.operator_enum("object.mode_set", "mode")
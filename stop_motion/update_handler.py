@@ -23,21 +23,132 @@ if "bpy" in locals():
 else:
     from . import modifier_data
 import bpy
-from .modifier_data import Modifier
+import time
+from collections import deque
+from .modifier_data import Modifier, is_stop_motion
+
+# (drawing index, mesh pointer) last applied per object pointer
+applied = {}
+# Stop motion objects in a sub-object mode, per object pointer
+registry = {}
+# (frame, seconds, swaps) of recent updates, for reporting
+timings = deque(maxlen=100)
+
+
+class Entry():
+    """A registered stop motion object, keeps its Modifier across frames"""
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.key = obj.as_pointer()
+        self.modifier = Modifier(obj)
+        self.pointer = self.modifier.modifier.as_pointer()
+
+    def valid(self):
+        """Still in a sub-object mode with the same modifier"""
+        try:
+            modifier = self.obj.modifiers.get(modifier_data.MODNAME)
+        except ReferenceError:
+            return False
+        if not modifier or self.obj.mode == 'OBJECT':
+            return False
+        if modifier.as_pointer() != self.pointer:
+            self.__init__(self.obj)
+        return True
+
+    def pending(self, frame):
+        """(index, data) if the drawing at frame isn't applied yet"""
+        index = self.modifier.index_at(frame)
+        data_pointer = self.obj.data.as_pointer()
+        if applied.get(self.key) == (index, data_pointer):
+            return None
+        data = modifier_data.unshare(self.modifier.get_object(index))
+        if data.as_pointer() == data_pointer:
+            applied[self.key] = (index, data_pointer)
+            return None
+        return index, data
+
+
+def swap_round_trip(mode):
+    """Edits only reach the old drawing on leaving the mode, and sculpt and
+    paint sessions are tied to the mesh; one trip through object mode
+    serves every object (e.g. multi-object edit mode)"""
+    def swap(changes):
+        bpy.ops.object.mode_set(mode='OBJECT')
+        for entry, index, data in changes:
+            entry.obj.data = data
+        bpy.ops.object.mode_set(mode=mode)
+    return swap
+
+
+def swap_direct(changes):
+    """No session holds on to the mesh, just swap it"""
+    for entry, index, data in changes:
+        entry.obj.data = data
+
+
+swaps = {
+    'EDIT': swap_round_trip('EDIT'),
+    'SCULPT': swap_round_trip('SCULPT'),
+    'VERTEX_PAINT': swap_round_trip('VERTEX_PAINT'),
+    'WEIGHT_PAINT': swap_round_trip('WEIGHT_PAINT'),
+    'TEXTURE_PAINT': swap_direct,
+    }
+
+
+def forget(obj=None):
+    """Drop what we know was applied, e.g. after a manual data change"""
+    if obj is None:
+        applied.clear()
+    else:
+        applied.pop(obj.as_pointer(), None)
+
+
+def track(objects):
+    """Register stop motion objects in sub-object modes, drop the rest"""
+    for obj in objects:
+        key = obj.as_pointer()
+        if is_stop_motion(obj) and obj.mode != 'OBJECT':
+            if key not in registry:
+                registry[key] = Entry(obj)
+        else:
+            registry.pop(key, None)
+        applied.pop(key, None)
 
 
 def stop_motion_data(scene):
     """Update object data as quickly as possible in non object modes"""
-    stop_motion_object = bpy.context.object
-    modifier = Modifier(stop_motion_object)
-    if not modifier.modifier:
-        return
-    mode = stop_motion_object.mode
-    if mode == 'OBJECT':
-        return
-    bpy.ops.object.mode_set(mode='OBJECT')
-    stop_motion_object.data = modifier.get_object().data
-    bpy.ops.object.mode_set(mode=mode)
+    start = time.perf_counter()
+    if not registry:
+        # e.g. the updater was toggled on without the mode switcher
+        obj = bpy.context.object
+        track([obj] if obj else [])
+    frame = scene.frame_current
+    changes = {}
+    for key, entry in list(registry.items()):
+        if not entry.valid():
+            del registry[key]
+            applied.pop(key, None)
+            continue
+        change = entry.pending(frame)
+        if change:
+            changes.setdefault(entry.obj.mode, []).append((entry, *change))
+    for mode, mode_changes in changes.items():
+        swaps.get(mode, swap_round_trip(mode))(mode_changes)
+        for entry, index, data in mode_changes:
+            applied[entry.key] = (index, data.as_pointer())
+    swapped = sum(len(mode_changes) for mode_changes in changes.values())
+    timings.append((frame, time.perf_counter() - start, swapped))
+
+
+def timing_report():
+    """Last and average milliseconds per frame of the updater"""
+    if not timings:
+        return None
+    last = timings[-1][1] * 1000
+    average = sum(t[1] for t in timings) * 1000 / len(timings)
+    swapped = sum(t[2] for t in timings)
+    return f"{last:.1f} ms (avg {average:.1f}, {swapped} swaps/{len(timings)})"
 
 
 def handler_loop(func):
@@ -58,6 +169,9 @@ def is_running(handler):
 def remove(handler):
     """Remove updater"""
     bpy.app.handlers.frame_change_pre.remove(handler)
+    forget()
+    registry.clear()
+    timings.clear()
 
 
 def add():
@@ -32,6 +32,8 @@ ONION = "onion"
 MAIN_OBJECT = "main"
 
 FRAME = "frame"
+# Fewest digits in drawing names, more once indices outgrow them
+FRAME_DIGITS = 4
 
 def get():
     return (MAJOR, MINOR, SUB)
@@ -60,8 +62,25 @@ def main_tag(item):
     item[item_tag[0]] = item_tag[1]
 
 
-def frame_name(index, obj):
-    return f"{NAME}_{FRAME}_{obj.name}_{index:04}"
+def frame_name(index, obj, digits=FRAME_DIGITS):
+    """Python looks drawings up by their index property, but the Collection
+    lookup node picks them by their place in name order, so every name in a
+    collection is padded to the same number of digits"""
+    return f"{NAME}_{FRAME}_{obj.name}_{index:0{digits}}"
+
+
+def frame_index(name):
+    """Index from a frame name, for files older than the index property"""
+    suffix = name.rsplit("_", 1)[-1]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def is_main(item):
+    return item.get(NAME, {}).get('type') == MAIN_OBJECT
+
+
+def is_onion(item):
+    return item.get(NAME, {}).get('type') == ONION
 
 
 def collection_name(obj):
@@ -0,0 +1,288 @@
+"""
+Round trips and broken file handling of mesh_io, which only needs numpy so
+it runs under plain pytest without Blender
+"""
+
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "stop_motion"))
+
+import mesh_io
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def quad_and_triangle(uvs=False):
+    positions = numpy.array(
+        [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 0, 0)],
+        dtype=numpy.float32)
+    loops = numpy.array([0, 1, 2, 3, 1, 4, 2], dtype=numpy.int32)
+    loop_starts = numpy.array([0, 4], dtype=numpy.int32)
+    corner_uvs = None
+    if uvs:
+        corner_uvs = numpy.linspace(0, 1, 14, dtype=numpy.float32).reshape(-1, 2)
+    return mesh_io.MeshBuffers(positions, loops, loop_starts, corner_uvs)
+
+
+def assert_same(buffers, expected):
+    numpy.testing.assert_allclose(buffers.positions, expected.positions, atol=1e-6)
+    numpy.testing.assert_array_equal(buffers.loops, expected.loops)
+    numpy.testing.assert_array_equal(buffers.loop_starts, expected.loop_starts)
+    if expected.uvs is None:
+        assert buffers.uvs is None
+    else:
+        numpy.testing.assert_allclose(buffers.uvs, expected.uvs, atol=1e-6)
+
+
+# OBJ
+
+
+@pytest.mark.parametrize("uvs", [False, True])
+def test_obj_round_trip(tmp_path, uvs):
+    expected = quad_and_triangle(uvs)
+    path = str(tmp_path / "drawing.obj")
+    mesh_io.write_obj(path, expected)
+    assert_same(mesh_io.read_obj(path), expected)
+
+
+def test_obj_negative_indices(tmp_path):
+    path = write(tmp_path, "relative.obj", b"v 0 0 0\nv 1 0 0\nv 0 1 0\nf -3 -2 -1\n")
+    numpy.testing.assert_array_equal(mesh_io.read_obj(path).loops, [0, 1, 2])
+
+
+def test_obj_missing_vertex(tmp_path):
+    path = write(tmp_path, "cut.obj", b"v 0 0 0\nv 1 0 0\nf 1 2 3\n")
+    with pytest.raises(ValueError):
+        mesh_io.read_obj(path)
+
+
+@pytest.mark.parametrize("data", [b"", b"v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2"])
+def test_obj_partial_has_no_faces(tmp_path, data):
+    """ Empty or cut off files parse, but aren't worth a drawing """
+    buffers = mesh_io.read_obj(write(tmp_path, "partial.obj", data))
+    assert not mesh_io.has_faces(buffers)
+
+
+def test_obj_has_faces(tmp_path):
+    path = str(tmp_path / "drawing.obj")
+    mesh_io.write_obj(path, quad_and_triangle())
+    assert mesh_io.has_faces(mesh_io.read_obj(path))
+
+
+# PLY
+
+
+QUAD_PLY = b"""ply
+format ascii 1.0
+comment quad and triangle
+element vertex 5
+property float x
+property float y
+property float z
+element face 2
+property list uchar int vertex_indices
+property uchar flags
+end_header
+0 0 0
+1 0 0
+1 1 0
+0 1 0
+2 0 0
+4 0 1 2 3 7
+3 1 4 2 7
+"""
+
+
+def test_ply_ascii(tmp_path):
+    """ Properties after the corner list are left out """
+    buffers = mesh_io.read_ply(write(tmp_path, "quad.ply", QUAD_PLY))
+    assert_same(buffers, quad_and_triangle())
+
+
+@pytest.mark.parametrize("order", ["<", ">"])
+def test_ply_binary(tmp_path, order):
+    expected = quad_and_triangle()
+    endian = "little" if order == "<" else "big"
+    header = (
+        f"ply\nformat binary_{endian}_endian 1.0\nelement vertex 5\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        "element face 2\nproperty list uchar int vertex_indices\nend_header\n")
+    faces = b"".join(
+        numpy.array(len(face), dtype="u1").tobytes()
+        + numpy.asarray(face, dtype=f"{order}i4").tobytes()
+        for face in numpy.split(expected.loops, expected.loop_starts[1:]))
+    data = (
+        header.encode() + expected.positions.astype(f"{order}f4").tobytes()
+        + faces)
+    assert_same(mesh_io.read_ply(write(tmp_path, "quad.ply", data)), expected)
+
+
+@pytest.mark.parametrize("cut", [
+    QUAD_PLY.index(b"1 1 0"),     # In the vertices
+    QUAD_PLY.index(b"3 1 4"),     # Before the last face
+    QUAD_PLY.index(b"4 2 7"),     # Inside the last face
+    QUAD_PLY.index(b"end_header"),
+    ])
+def test_ply_ascii_truncated(tmp_path, cut):
+    with pytest.raises(ValueError):
+        mesh_io.read_ply(write(tmp_path, "cut.ply", QUAD_PLY[:cut]))
+
+
+def test_ply_binary_truncated(tmp_path):
+    data = (
+        b"ply\nformat binary_little_endian 1.0\nelement vertex 3\n"
+        b"property float x\nproperty float y\nproperty float z\nend_header\n"
+        + numpy.zeros(8, dtype="<f4").tobytes())
+    with pytest.raises(ValueError):
+        mesh_io.read_ply(write(tmp_path, "cut.ply", data))
+
+
+def test_ply_unknown_type(tmp_path):
+    data = QUAD_PLY.replace(b"property float x", b"property half x")
+    with pytest.raises(ValueError):
+        mesh_io.read_ply(write(tmp_path, "half.ply", data))
+
+
+def test_not_ply(tmp_path):
+    with pytest.raises(ValueError):
+        mesh_io.read_ply(write(tmp_path, "text.ply", b"solid\n"))
+
+
+# STL
+
+
+TRIANGLES = numpy.array([
+    [(0, 0, 0), (1, 0, 0), (1, 1, 0)],
+    [(0, 0, 0), (1, 1, 0), (0, 1, 0)]], dtype=numpy.float32)
+
+
+def binary_stl(triangles):
+    record = numpy.dtype([
+        ("normal", "<f4", (3,)), ("corners", "<f4", (3, 3)), ("attribute", "<u2")])
+    table = numpy.zeros(len(triangles), dtype=record)
+    table["corners"] = triangles
+    return (
+        bytes(80) + numpy.array(len(triangles), dtype="<u4").tobytes()
+        + table.tobytes())
+
+
+def test_stl_binary_welds_in_order(tmp_path):
+    buffers = mesh_io.read_stl(write(tmp_path, "quad.stl", binary_stl(TRIANGLES)))
+    numpy.testing.assert_allclose(
+        buffers.positions, [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)])
+    numpy.testing.assert_array_equal(buffers.loops, [0, 1, 2, 0, 2, 3])
+    numpy.testing.assert_array_equal(buffers.loop_starts, [0, 3])
+
+
+def test_stl_ascii(tmp_path):
+    facets = "".join(
+        "facet normal 0 0 1\nouter loop\n"
+        + "".join(f"vertex {x} {y} {z}\n" for x, y, z in triangle)
+        + "endloop\nendfacet\n" for triangle in TRIANGLES)
+    data = f"solid quad\n{facets}endsolid quad\n".encode()
+    buffers = mesh_io.read_stl(write(tmp_path, "quad.stl", data))
+    numpy.testing.assert_array_equal(buffers.loops, [0, 1, 2, 0, 2, 3])
+
+
+def test_stl_truncated(tmp_path):
+    data = binary_stl(TRIANGLES)[:-20]
+    with pytest.raises(ValueError):
+        mesh_io.read_stl(write(tmp_path, "cut.stl", data))
+
+
+def test_read_mesh_unsupported(tmp_path):
+    with pytest.raises(ValueError):
+        mesh_io.read_mesh(write(tmp_path, "drawing.fbx", b""))
+
+
+# Vertex caches
+
+
+def take(frames=3, count=4):
+    return numpy.arange(frames * count * 3, dtype=numpy.float32).reshape(
+        frames, count, 3)
+
+
+def test_mdd(tmp_path):
+    positions = take()
+    path = str(tmp_path / "take.mdd")
+    mesh_io.write_mdd(path, positions, [0, 0.5, 1])
+    data = open(path, 'rb').read()
+    numpy.testing.assert_array_equal(numpy.frombuffer(data, ">i4", 2), (3, 4))
+    numpy.testing.assert_allclose(numpy.frombuffer(data, ">f4", 3, 8), (0, 0.5, 1))
+    numpy.testing.assert_array_equal(
+        numpy.frombuffer(data, ">f4", offset=20).reshape(positions.shape), positions)
+
+
+def test_pc2(tmp_path):
+    positions = take()
+    path = str(tmp_path / "take.pc2")
+    mesh_io.write_pc2(path, positions, 10)
+    data = open(path, 'rb').read()
+    assert data[:12] == b"POINTCACHE2\0"
+    numpy.testing.assert_array_equal(numpy.frombuffer(data, "<i4", 2, 12), (1, 4))
+    numpy.testing.assert_allclose(numpy.frombuffer(data, "<f4", 2, 20), (10, 1))
+    assert numpy.frombuffer(data, "<i4", 1, 28)[0] == 3
+    numpy.testing.assert_array_equal(
+        numpy.frombuffer(data, "<f4", offset=32).reshape(positions.shape), positions)
+
+
+# Drawing cache
+
+
+def cached_drawings():
+    buffers = quad_and_triangle()
+    arrays = {
+        "positions": buffers.positions,
+        "loops": buffers.loops,
+        "loop_starts": buffers.loop_starts,
+        "weights": numpy.linspace(0, 1, 5, dtype=numpy.float32),
+        "empty": numpy.zeros((0, 2), dtype=numpy.int32),
+        }
+    return {
+        0: ({"name": "first"}, arrays),
+        3: ({"name": "second"}, {**arrays, "positions": buffers.positions * 2}),
+        }
+
+
+def test_drawing_cache_round_trip(tmp_path):
+    path = str(tmp_path / f"take{mesh_io.CACHE_EXTENSION}")
+    drawings = cached_drawings()
+    mesh_io.write_cache(path, {1: 0, 5: 3, 9: 0}, drawings)
+    cache = mesh_io.DrawingCache(path)
+    assert sorted(cache) == [0, 3]
+    assert cache.frames == [(1, 0), (5, 3), (9, 0)]
+    assert [cache.index_at(frame) for frame in (0, 1, 4, 5, 8, 9, 20)] == [
+        None, 0, 0, 3, 3, 0, 0]
+    for index, (info, arrays) in drawings.items():
+        assert cache.info(index) == info
+        cached = cache.arrays(index)
+        assert cached.keys() == arrays.keys()
+        for name, array in arrays.items():
+            assert cached[name].dtype == array.dtype
+            numpy.testing.assert_array_equal(cached[name], array)
+
+
+def test_drawing_cache_truncated(tmp_path):
+    path = str(tmp_path / f"take{mesh_io.CACHE_EXTENSION}")
+    mesh_io.write_cache(path, {1: 3}, cached_drawings())
+    data = open(path, 'rb').read()
+    open(path, 'wb').write(data[:-8])
+    with pytest.raises(ValueError):
+        mesh_io.DrawingCache(path).arrays(3)
+    open(path, 'wb').write(data[:20])
+    with pytest.raises(ValueError):
+        mesh_io.DrawingCache(path)
+
+
+def test_not_a_drawing_cache(tmp_path):
+    with pytest.raises(ValueError):
+        mesh_io.DrawingCache(write(tmp_path, "take.drawings", b"ply\n"))